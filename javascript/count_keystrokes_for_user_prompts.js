@@ -4,7 +4,7 @@ onloadAdd(() => {
         let textarea = me(ev); // Get the textarea element
         keystrokeCount++; // Increment the keystroke count
         if (keystrokeCount % 50 === 0 && keystrokeCount >= 50) {
-            htmx.ajax("POST", "/prompt_user", {
+            htmx.ajax("POST", "/prompt_user_stream", {
                 target: "#diary-prompt",
                 swap: "innerHTML",
                 values: { text: textarea.value }
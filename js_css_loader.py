@@ -1,7 +1,10 @@
+import functools
 import glob
 import os
 
 
+# Read on first use rather than at import, and then kept for the life of the process
+@functools.cache
 def load_styles():
     STYLE_DIRECTORY = "styles/"
     file_list = glob.glob(STYLE_DIRECTORY + "*.css")
@@ -13,6 +16,7 @@ def load_styles():
     return styles
 
 
+@functools.cache
 def load_js():
     JAVASCRIPT_DIRECTORY = "javascript/"
     file_list = glob.glob(JAVASCRIPT_DIRECTORY + "*.js")
@@ -22,7 +26,3 @@ def load_js():
             print("Storing", os.path.basename(file_path))
             js[os.path.basename(file_path)] = f.read()
     return js
-
-
-styles = load_styles()
-js = load_js()
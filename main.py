@@ -1,113 +1,287 @@
+import asyncio
 import os
-from typing import Callable
 
 import fasthtml.common as fh
 from dotenv import load_dotenv
-from openai import OpenAI
 
+import modules.analysis_queue as analysis_queue
 import modules.auth as auth
 import modules.dashboard as dashboard
 import modules.diary_analysis as diary_analysis
+import modules.entries_repository as entries_repository
+import modules.entry_cache as entry_cache
 import modules.homepage as homepage
+import modules.llm_backend as llm_backend
+import modules.llm_cache as llm_cache
+import modules.prompt_drafts as prompt_drafts
+import modules.score_rollups as score_rollups
+import modules.startup as startup
+import modules.streaming as streaming
+import modules.summaries as summaries
 from modules.auth import Auth
-from modules.db import init_db
+from modules.db import check_connection, create_indexes, init_async_db, init_db
+from modules.llm_backend import LLMBackend
+
+READY_TIMEOUT_SECONDS = float(os.getenv("READY_TIMEOUT_SECONDS", "2"))
 
-print("Link: http://localhost:5001")
-load_dotenv()
-
-openai_client: OpenAI = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-app: fh.FastHTML | fh.FastHTMLWithLiveReload
-rt: Callable
-app, rt = fh.fast_app(
-    live=True,
-    pico=False,
-    hdrs=(
-        # plotly
-        fh.Script(src="https://cdn.plot.ly/plotly-2.32.0.min.js"),
-        # franken ui: https://franken-ui.dev/docs/installation
-        fh.Link(
-            rel="stylesheet",
-            href="https://unpkg.com/franken-ui@2.0.0-internal.38/dist/css/core.min.css",
-        ),
-        fh.Link(
-            rel="stylesheet",
-            href="https://unpkg.com/franken-ui@2.0.0-internal.38/dist/css/utilities.min.css",
-        ),
-        fh.Script(
-            src="https://unpkg.com/franken-ui@2.0.0-internal.38/dist/js/core.iife.js",
-            type="module",
-        ),
-        fh.Script(
-            src="https://unpkg.com/franken-ui@2.0.0-internal.38/dist/js/icon.iife.js",
-            type="module",
-        ),
-        # notion style: https://github.com/miloxeon/potion/tree/master
-        fh.Link(rel="stylesheet", href="styles/notion.css", type="text/css"),
-        fh.Link(
-            rel="stylesheet",
-            href="https://fonts.googleapis.com/css2?family=Gamja+Flower&display=swap",
-        ),
-    ),
-)
 
-db, users_collection = init_db()
-oauth = Auth(app, auth.google_auth_client)
-oauth.users_collection = users_collection
+def create_app() -> fh.FastHTML:
+    """Builds the app and its routes without waiting on the network.
 
+    The database clients connect lazily, and the connection check, index creation and
+    LLM client setup run on a startup thread once the server is listening.
+    """
+    load_dotenv()
 
-@rt("/")
-def get(auth, session) -> fh.FT:
-    return homepage.homepage(auth, session, users_collection)
+    llm: LLMBackend = llm_backend.create_backend()
 
+    # Blocking client for the analysis worker threads and OAuth, Motor for the request handlers
+    db, users_collection, entries_collection = init_db()
+    async_db, async_users_collection, async_entries_collection = init_async_db()
+    llm_cache.init_persistent_cache(db, async_db)
+    entry_cache.init_entry_cache(users_collection, async_users_collection)
+    jobs_collection = analysis_queue.init_jobs_collection(db)
+    rollups_collection = score_rollups.init_rollups_collection(db)
+    async_jobs_collection = async_db[jobs_collection.name]
+    async_rollups_collection = async_db[rollups_collection.name]
+    summaries_collection = summaries.init_summaries_collection(db)
+    async_summaries_collection = async_db[summaries_collection.name]
+    drafts_collection = prompt_drafts.init_drafts_collection(db)
+    async_drafts_collection = async_db[drafts_collection.name]
 
-@rt("/submit")
-def post(text: str, happiness_score: int, session) -> fh.FT:
-    return diary_analysis.category_analysis(
-        text, happiness_score, openai_client, session, users_collection
+    def create_all_indexes():
+        create_indexes(users_collection, entries_collection)
+        analysis_queue.create_indexes(jobs_collection)
+        prompt_drafts.create_indexes(drafts_collection)
+        entries_repository.create_feature_indexes(
+            entries_collection, [key for key, *_ in diary_analysis.CATEGORIES]
+        )
+        llm_cache.create_indexes()
+
+    def start_analysis_workers():
+        analysis_queue.start_workers(
+            jobs_collection,
+            lambda job: diary_analysis.process_analysis_job(
+                job, llm, entries_collection, rollups_collection
+            ),
+            lambda job: diary_analysis.fail_analysis_job(job, entries_collection),
+        )
+
+    def start():
+        startup.run_in_background(
+            [
+                ("mongo", lambda: check_connection(db)),
+                ("indexes", create_all_indexes),
+                ("llm", llm.warm_up),
+                ("analysis_workers", start_analysis_workers),
+            ]
+        )
+
+    app, rt = fh.fast_app(
+        live=True,
+        pico=False,
+        # Only the serving process runs startup, not the live reload supervisor
+        on_startup=[start],
+        on_shutdown=[analysis_queue.stop_workers],
+        hdrs=(
+            fh.Script(src=streaming.SSE_EXTENSION_SRC),
+            # plotly
+            fh.Script(src="https://cdn.plot.ly/plotly-2.32.0.min.js"),
+            # franken ui: https://franken-ui.dev/docs/installation
+            fh.Link(
+                rel="stylesheet",
+                href="https://unpkg.com/franken-ui@2.0.0-internal.38/dist/css/core.min.css",
+            ),
+            fh.Link(
+                rel="stylesheet",
+                href="https://unpkg.com/franken-ui@2.0.0-internal.38/dist/css/utilities.min.css",
+            ),
+            fh.Script(
+                src="https://unpkg.com/franken-ui@2.0.0-internal.38/dist/js/core.iife.js",
+                type="module",
+            ),
+            fh.Script(
+                src="https://unpkg.com/franken-ui@2.0.0-internal.38/dist/js/icon.iife.js",
+                type="module",
+            ),
+            # notion style: https://github.com/miloxeon/potion/tree/master
+            fh.Link(rel="stylesheet", href="styles/notion.css", type="text/css"),
+            fh.Link(
+                rel="stylesheet",
+                href="https://fonts.googleapis.com/css2?family=Gamja+Flower&display=swap",
+            ),
+        ),
     )
 
+    oauth = Auth(
+        app,
+        auth.google_auth_client,
+        # Probes must not be redirected to the login page
+        skip=["/redirect", "/error", "/login", "/healthz", "/readyz"],
+    )
+    oauth.users_collection = users_collection
 
-@rt("/search")
-def post(search_query: str, session) -> fh.FT:
-    return homepage.search(search_query, session, users_collection, openai_client)
+    @rt("/healthz")
+    def get():
+        return fh.JSONResponse({"status": "ok"})
 
+    @rt("/readyz")
+    async def get():
+        steps = startup.get_status()
+        ready = startup.is_ready()
+        if ready:
+            try:
+                await asyncio.wait_for(
+                    async_db.command("ping"), timeout=READY_TIMEOUT_SECONDS
+                )
+            except Exception as e:
+                ready = False
+                steps["mongo"] = f"{type(e).__name__}: {e}"
+        return fh.JSONResponse(
+            {"status": "ready" if ready else "not ready", "steps": steps},
+            status_code=200 if ready else 503,
+        )
 
-@rt("/login")
-def login(req):
-    return auth.login(req, oauth)
+    @rt("/")
+    async def get(auth, session) -> fh.FT:
+        return await homepage.homepage(auth, session, async_entries_collection)
 
+    @rt("/history")
+    async def get(before: str, session):
+        return await homepage.history(before, session, async_entries_collection)
 
-@rt("/auth/logout")
-def logout(session):
-    return auth.logout(session)
+    @rt("/submit")
+    async def post(text: str, happiness_score: int, session) -> fh.FT:
+        return await diary_analysis.category_analysis(
+            text,
+            happiness_score,
+            session,
+            async_entries_collection,
+            async_jobs_collection,
+            async_rollups_collection,
+        )
 
+    @rt("/analysis_status")
+    async def get(job_id: str, session) -> fh.FT:
+        return await diary_analysis.analysis_status(
+            job_id, session, async_entries_collection, async_jobs_collection
+        )
 
-@rt("/prompt_user")
-def post(text: str = "") -> fh.FT:
-    return diary_analysis.prompt_user(text, openai_client)
+    @rt("/search")
+    async def post(search_query: str, session) -> fh.FT:
+        return await homepage.search(
+            search_query, session, async_entries_collection, llm
+        )
 
+    @rt("/login")
+    def login(req):
+        return auth.login(req, oauth)
 
-@rt("/dashboard")
-def get(session):
-    return dashboard.plot_diary_data(session, users_collection)
+    @rt("/auth/logout")
+    def logout(session):
+        return auth.logout(session)
 
+    @rt("/prompt_user")
+    async def post(session, text: str = "") -> fh.FT:
+        return await diary_analysis.prompt_user(
+            text, llm, session, async_drafts_collection
+        )
 
-@rt("/improvement_suggestions")
-def get(session, feature: str):
-    return dashboard.improvement_suggestions(
-        feature, openai_client, session, users_collection
-    )
+    @rt("/prompt_user_stream")
+    async def post(session, text: str = "") -> fh.FT:
+        return await diary_analysis.prompt_user_stream_target(
+            text, session, async_drafts_collection
+        )
 
+    @rt("/prompt_user_stream")
+    async def get(session, draft_id: str):
+        return fh.EventStream(
+            await diary_analysis.prompt_user_stream(
+                draft_id, session, llm, async_drafts_collection
+            )
+        )
 
-@rt("/weekly_summary")
-def get(session):
-    return dashboard.weekly_summary(openai_client, session, users_collection)
+    @rt("/dashboard")
+    async def get(session):
+        return await dashboard.plot_diary_data(
+            session, async_entries_collection, async_rollups_collection
+        )
 
+    @rt("/dashboard/plot_data")
+    async def get(req, session, kind: str = "days", points: int = 0):
+        return await dashboard.plot_data(
+            req,
+            kind,
+            points,
+            session,
+            async_entries_collection,
+            async_rollups_collection,
+        )
 
-@rt("/diary")
-def get(date: str, session):
-    return homepage.diary(date, session, users_collection)
+    @rt("/improvement_suggestions")
+    async def get(session, feature: str):
+        return await dashboard.improvement_suggestions(
+            feature, llm, session, async_entries_collection, async_rollups_collection
+        )
 
+    @rt("/improvement_suggestions_stream")
+    async def get(session, feature: str):
+        return fh.EventStream(
+            await dashboard.improvement_suggestions_stream(
+                feature,
+                llm,
+                session,
+                async_entries_collection,
+                async_rollups_collection,
+            )
+        )
+
+    @rt("/weekly_summary")
+    async def get(session):
+        return await dashboard.weekly_summary(
+            llm, session, async_entries_collection, async_summaries_collection
+        )
+
+    @rt("/weekly_summary_stream")
+    async def get(session):
+        return fh.EventStream(
+            await dashboard.weekly_summary_stream(
+                llm, session, async_entries_collection, async_summaries_collection
+            )
+        )
+
+    @rt("/monthly_summary_stream")
+    async def get(session):
+        return fh.EventStream(
+            await dashboard.monthly_summary_stream(
+                llm, session, async_entries_collection, async_summaries_collection
+            )
+        )
+
+    @rt("/llm_cache_stats")
+    def get():
+        return fh.JSONResponse(llm_cache.get_stats())
+
+    @rt("/month")
+    async def get(month: str, session):
+        return await homepage.month(month, session, async_entries_collection)
+
+    @rt("/entry_cache_stats")
+    def get():
+        return fh.JSONResponse(entry_cache.get_stats())
+
+    @rt("/summary_stats")
+    def get():
+        return fh.JSONResponse(summaries.get_stats())
+
+    @rt("/diary")
+    async def get(date: str, session):
+        return await homepage.diary(date, session, async_entries_collection)
+
+    return app
+
+
+print("Link: http://localhost:5001")
+app = create_app()
 
 fh.serve(host="localhost", port=5001)
@@ -0,0 +1,274 @@
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+WORKER_COUNT = int(os.getenv("ANALYSIS_WORKERS", "4"))
+POLL_SECONDS = float(os.getenv("ANALYSIS_POLL_SECONDS", "1"))
+LEASE_SECONDS = int(os.getenv("ANALYSIS_LEASE_SECONDS", "120"))
+# A running job renews its lease this often, so a slow LLM call is not reclaimed
+HEARTBEAT_SECONDS = LEASE_SECONDS / 4
+MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "3"))
+RETRY_BACKOFF_SECONDS = int(os.getenv("ANALYSIS_RETRY_BACKOFF_SECONDS", "10"))
+
+# A finished job no longer needs the entry it analyzed
+_FINISHED_UNSET = {"locked_until": "", "lease": "", "text": "", "previous": ""}
+
+_stop_event = threading.Event()
+_workers: list[threading.Thread] = []
+
+
+def init_jobs_collection(db: Database) -> Collection:
+    return db["analysis_jobs"]
+
+
+def create_indexes(jobs_collection: Collection) -> None:
+    jobs_collection.create_index([("status", 1), ("run_after", 1)])
+    jobs_collection.create_index([("google_id", 1), ("date", 1)])
+    print("✅ Analysis job indexes created")
+
+
+async def enqueue(
+    jobs_collection: AsyncIOMotorCollection,
+    google_id: str,
+    date: str,
+    text: str,
+    previous: Optional[dict] = None,
+) -> str:
+    """Queues an analysis of the entry for `date`, superseding older queued ones.
+
+    Args:
+        previous (Optional[dict]): The last analyzed version of the entry, if its results can be reused
+
+    Returns:
+        str: Id of the queued job, used to poll for its status
+    """
+    now = datetime.now()
+    await jobs_collection.update_many(
+        {"google_id": google_id, "date": date, "status": "pending"},
+        {
+            "$set": {"status": "superseded", "updated_at": now},
+            "$unset": {"text": "", "previous": ""},
+        },
+    )
+    result = await jobs_collection.insert_one(
+        {
+            "google_id": google_id,
+            "date": date,
+            "text": text,
+            "previous": previous,
+            "status": "pending",
+            "attempts": 0,
+            "run_after": now,
+            "created_at": now,
+            "updated_at": now,
+        }
+    )
+    return str(result.inserted_id)
+
+
+async def get_job(
+    jobs_collection: AsyncIOMotorCollection, job_id: str, google_id: str
+) -> Optional[dict]:
+    if not ObjectId.is_valid(job_id):
+        return None
+    return await jobs_collection.find_one(
+        {"_id": ObjectId(job_id), "google_id": google_id},
+        {"text": 0, "previous": 0, "lease": 0},
+    )
+
+
+def _fail_expired(
+    jobs_collection: Collection, on_failed: Callable[[dict], None]
+) -> None:
+    """Fails running jobs whose lease ran out on their last attempt."""
+    # Their worker died, one that still had attempts left is claimable again instead
+    while True:
+        now = datetime.now()
+        job = jobs_collection.find_one_and_update(
+            {
+                "status": "running",
+                "locked_until": {"$lt": now},
+                "attempts": {"$gte": MAX_ATTEMPTS},
+            },
+            {
+                "$set": {
+                    "status": "failed",
+                    "error": "Lease expired",
+                    "updated_at": now,
+                },
+                "$unset": _FINISHED_UNSET,
+            },
+        )
+        if job is None:
+            return
+        _report_failed(job, on_failed)
+
+
+def _claim(jobs_collection: Collection) -> Optional[dict]:
+    """Claims the next due job under a new lease token, which only its worker knows."""
+    # A running job whose lease ran out belongs to a worker that died, so it is
+    # claimable again
+    now = datetime.now()
+    return jobs_collection.find_one_and_update(
+        {
+            "$or": [
+                {"status": "pending", "run_after": {"$lte": now}},
+                {
+                    "status": "running",
+                    "locked_until": {"$lt": now},
+                    "attempts": {"$lt": MAX_ATTEMPTS},
+                },
+            ]
+        },
+        {
+            "$set": {
+                "status": "running",
+                "lease": uuid.uuid4().hex,
+                "locked_until": now + timedelta(seconds=LEASE_SECONDS),
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("run_after", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _renew_lease(jobs_collection: Collection, job: dict) -> bool:
+    """Extends the lease of `job`, False once another worker has claimed it."""
+    now = datetime.now()
+    result = jobs_collection.update_one(
+        {"_id": job["_id"], "lease": job["lease"]},
+        {
+            "$set": {
+                "locked_until": now + timedelta(seconds=LEASE_SECONDS),
+                "updated_at": now,
+            }
+        },
+    )
+    return bool(result.matched_count)
+
+
+def _heartbeat(jobs_collection: Collection, job: dict, done: threading.Event) -> None:
+    while not done.wait(HEARTBEAT_SECONDS):
+        try:
+            if not _renew_lease(jobs_collection, job):
+                print(f"⚠️ Lost the lease of analysis job {job['_id']}")
+                return
+        except Exception as e:
+            # The lease is still good until it runs out, try again on the next beat
+            print(f"⚠️ Could not renew analysis job {job['_id']}: {e}")
+
+
+def _report_failed(job: dict, on_failed: Callable[[dict], None]) -> None:
+    try:
+        on_failed(job)
+    except Exception as e:
+        print(f"⚠️ Could not report failed analysis job {job['_id']}: {e}")
+
+
+def _finish(
+    jobs_collection: Collection,
+    job: dict,
+    error: Optional[Exception],
+    on_failed: Callable[[dict], None],
+) -> None:
+    now = datetime.now()
+    unset = _FINISHED_UNSET
+    if error is None:
+        update = {"status": "done"}
+    elif job["attempts"] < MAX_ATTEMPTS:
+        update = {
+            "status": "pending",
+            "run_after": now
+            + timedelta(seconds=RETRY_BACKOFF_SECONDS * job["attempts"]),
+            "error": str(error),
+        }
+        # The retry needs the entry again
+        unset = {"locked_until": "", "lease": ""}
+    else:
+        update = {"status": "failed", "error": str(error)}
+    # Only the worker holding the lease settles the job, a reclaimed one is left alone
+    result = jobs_collection.update_one(
+        {"_id": job["_id"], "lease": job["lease"]},
+        {"$set": {**update, "updated_at": now}, "$unset": unset},
+    )
+    if not result.matched_count:
+        print(f"⚠️ Analysis job {job['_id']} was reclaimed, result not recorded")
+    elif update["status"] == "failed":
+        _report_failed(job, on_failed)
+
+
+def _work(
+    jobs_collection: Collection,
+    handler: Callable[[dict], None],
+    on_failed: Callable[[dict], None],
+) -> None:
+    while not _stop_event.is_set():
+        try:
+            _fail_expired(jobs_collection, on_failed)
+            job = _claim(jobs_collection)
+        except Exception as e:
+            print(f"⚠️ Could not claim analysis job: {e}")
+            job = None
+        if job is None:
+            _stop_event.wait(POLL_SECONDS)
+            continue
+
+        error: Optional[Exception] = None
+        done = threading.Event()
+        heartbeat = threading.Thread(
+            target=_heartbeat, args=(jobs_collection, job, done), daemon=True
+        )
+        heartbeat.start()
+        try:
+            handler(job)
+        except Exception as e:
+            print(f"🔥 Analysis job {job['_id']} failed: {e}")
+            error = e
+        finally:
+            done.set()
+            heartbeat.join()
+        try:
+            _finish(jobs_collection, job, error, on_failed)
+        except Exception as e:
+            print(f"⚠️ Could not update analysis job {job['_id']}: {e}")
+
+
+def start_workers(
+    jobs_collection: Collection,
+    handler: Callable[[dict], None],
+    on_failed: Callable[[dict], None],
+) -> None:
+    """Starts the worker threads that run `handler` on each claimed job.
+
+    Args:
+        on_failed (Callable[[dict], None]): Called with a job, its text included, once
+            it has failed its last attempt
+    """
+    _stop_event.clear()
+    for i in range(WORKER_COUNT):
+        worker = threading.Thread(
+            target=_work,
+            args=(jobs_collection, handler, on_failed),
+            name=f"analysis-worker-{i}",
+            daemon=True,
+        )
+        worker.start()
+        _workers.append(worker)
+    print(f"✅ Started {WORKER_COUNT} analysis workers")
+
+
+def stop_workers() -> None:
+    _stop_event.set()
+    for worker in _workers:
+        worker.join(timeout=POLL_SECONDS * 2)
+    _workers.clear()
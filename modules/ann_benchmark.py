@@ -0,0 +1,76 @@
+"""Recall and latency of the HNSW search against the exact search.
+
+Usage: python -m modules.ann_benchmark --entries 10000 --queries 200 --k 5
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import modules.ann_index as ann_index
+from modules.llm_backend import EMBEDDING_DIMENSIONS
+from modules.vector_index import UserVectorIndex
+
+
+def _clustered_vectors(
+    rng: np.random.Generator, count: int, dimensions: int, clusters: int
+) -> np.ndarray:
+    # Diary embeddings cluster by topic, which uniform random vectors would not capture
+    centers = rng.standard_normal((clusters, dimensions))
+    assignments = rng.integers(0, clusters, count)
+    vectors = centers[assignments] + 0.5 * rng.standard_normal((count, dimensions))
+    return vectors.astype(np.float32)
+
+
+def _percentiles(seconds: list[float]) -> str:
+    p50, p99 = np.percentile(np.array(seconds) * 1000, [50, 99])
+    return f"p50 {p50:.3f} ms, p99 {p99:.3f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dimensions", type=int, default=EMBEDDING_DIMENSIONS)
+    parser.add_argument("--clusters", type=int, default=50)
+    args = parser.parse_args()
+
+    if ann_index.hnswlib is None:
+        raise SystemExit("hnswlib is not installed: pip install hnswlib")
+
+    rng = np.random.default_rng(0)
+    vectors = _clustered_vectors(rng, args.entries, args.dimensions, args.clusters)
+    queries = _clustered_vectors(rng, args.queries, args.dimensions, args.clusters)
+    dates = [f"entry-{i}" for i in range(args.entries)]
+
+    exact = UserVectorIndex(list(dates), [""] * args.entries, vectors)
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        ann = ann_index.HnswIndex(f"{directory}/benchmark", args.dimensions)
+        ann.sync(dates, exact.matrix)
+        print(
+            f"HNSW build: {time.perf_counter() - start:.2f} s for {args.entries} entries"
+        )
+
+        exact_seconds, ann_seconds, recalls = [], [], []
+        for query in queries:
+            start = time.perf_counter()
+            expected = {date for date, _ in exact.search(query, args.k)}
+            exact_seconds.append(time.perf_counter() - start)
+
+            normalized = query / np.linalg.norm(query)
+            start = time.perf_counter()
+            found = set(ann.search(normalized, args.k))
+            ann_seconds.append(time.perf_counter() - start)
+            recalls.append(len(expected & found) / len(expected))
+
+    print(f"Exact: {_percentiles(exact_seconds)}")
+    print(f"HNSW:  {_percentiles(ann_seconds)}")
+    print(f"Recall@{args.k}: {np.mean(recalls):.4f}")
+
+
+if __name__ == "__main__":
+    main()
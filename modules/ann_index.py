@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+try:
+    # Optional CPU-only HNSW engine: pip install hnswlib
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# "exact" searches the whole matrix, "hnsw" uses an approximate index for large histories
+ENGINE = os.getenv("VECTOR_SEARCH_ENGINE", "exact")
+MIN_ENTRIES = int(os.getenv("ANN_MIN_ENTRIES", "2000"))
+INDEX_DIRECTORY = os.getenv("ANN_INDEX_DIR", "ann_indexes/")
+M = int(os.getenv("ANN_M", "16"))
+EF_CONSTRUCTION = int(os.getenv("ANN_EF_CONSTRUCTION", "200"))
+EF_SEARCH = int(os.getenv("ANN_EF_SEARCH", "64"))
+# Writes within this window are saved to disk together, off the request path
+SAVE_DELAY_SECONDS = float(os.getenv("ANN_SAVE_DELAY_SECONDS", "30"))
+
+
+def enabled(entry_count: int) -> bool:
+    if ENGINE != "hnsw":
+        return False
+    if hnswlib is None:
+        print(
+            "⚠️ VECTOR_SEARCH_ENGINE=hnsw but hnswlib is not installed, using exact search"
+        )
+        return False
+    return entry_count >= MIN_ENTRIES
+
+
+def _vector_hash(vector: np.ndarray) -> str:
+    return hashlib.sha256(
+        np.ascontiguousarray(vector, dtype=np.float32).tobytes()
+    ).hexdigest()
+
+
+class HnswIndex:
+    """HNSW graph over pre-normalized vectors, labelled by entry date and saved to disk.
+
+    Inner product on unit vectors is cosine similarity, so results rank the same as
+    the exact search. The hash of each label's vector is saved with it, so vectors that
+    changed while the index was not loaded are replaced when it is synced.
+    """
+
+    def __init__(self, path: str, dimensions: int):
+        self.path = path
+        self.dimensions = dimensions
+        self.lock = threading.Lock()
+        self.index = hnswlib.Index(space="ip", dim=dimensions)
+        self.dates: list[str] = []
+        self.hashes: list[Optional[str]] = []
+        self.save_timer: Optional[threading.Timer] = None
+        if os.path.exists(path + ".bin") and os.path.exists(path + ".json"):
+            with open(path + ".json", "r") as f:
+                saved = json.load(f)
+            if isinstance(saved, list):
+                # Saved before hashes were kept, every vector is replaced on sync
+                saved = {"dates": saved, "hashes": [None] * len(saved)}
+            self.dates, self.hashes = saved["dates"], saved["hashes"]
+            self.index.load_index(path + ".bin")
+        else:
+            self.index.init_index(
+                max_elements=1024, M=M, ef_construction=EF_CONSTRUCTION
+            )
+        self.labels = {date: label for label, date in enumerate(self.dates)}
+        self.index.set_ef(EF_SEARCH)
+
+    def _add(self, dates: list[str], vectors: np.ndarray) -> None:
+        labels = []
+        for date, vector in zip(dates, vectors):
+            if date not in self.labels:
+                self.labels[date] = len(self.dates)
+                self.dates.append(date)
+                self.hashes.append(None)
+            labels.append(self.labels[date])
+            self.hashes[self.labels[date]] = _vector_hash(vector)
+        if len(self.dates) > self.index.get_max_elements():
+            self.index.resize_index(
+                max(2 * self.index.get_max_elements(), len(self.dates))
+            )
+        # Adding an existing label replaces its vector
+        self.index.add_items(vectors, labels)
+
+    def sync(self, dates: list[str], vectors: np.ndarray) -> None:
+        """Adds entries missing from the saved index or whose vector changed, e.g. in another process."""
+        with self.lock:
+            stale = [
+                i
+                for i, date in enumerate(dates)
+                if date not in self.labels
+                or self.hashes[self.labels[date]] != _vector_hash(vectors[i])
+            ]
+            if not stale:
+                return
+            self._add([dates[i] for i in stale], vectors[stale])
+            self._save()
+
+    def upsert(self, date: str, vector: np.ndarray) -> None:
+        with self.lock:
+            self._add([date], vector.reshape(1, -1))
+            # A save lost on exit is caught up by the next sync, as the hash will differ
+            if self.save_timer is None:
+                self.save_timer = threading.Timer(SAVE_DELAY_SECONDS, self._save_later)
+                self.save_timer.daemon = True
+                self.save_timer.start()
+
+    def search(self, query: np.ndarray, k: int) -> list[str]:
+        with self.lock:
+            k = min(k, self.index.get_current_count())
+            if k == 0:
+                return []
+            self.index.set_ef(max(EF_SEARCH, k))
+            labels, _ = self.index.knn_query(query.reshape(1, -1), k=k)
+        return [self.dates[label] for label in labels[0]]
+
+    def _save_later(self) -> None:
+        with self.lock:
+            self.save_timer = None
+            self._save()
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.index.save_index(self.path + ".bin")
+        with open(self.path + ".json", "w") as f:
+            json.dump({"dates": self.dates, "hashes": self.hashes}, f)
+
+
+def load(google_id: str, dates: list[str], vectors: np.ndarray) -> Optional[HnswIndex]:
+    """Loads the user's saved index, catching it up with `dates` and their `vectors`."""
+    if not enabled(len(dates)):
+        return None
+    # Hash the id so it is safe to use as a file name
+    name = hashlib.sha256(google_id.encode("utf-8")).hexdigest()
+    index = HnswIndex(os.path.join(INDEX_DIRECTORY, name), vectors.shape[1])
+    index.sync(dates, vectors)
+    return index
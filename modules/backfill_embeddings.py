@@ -0,0 +1,63 @@
+"""Converts diary entry embeddings stored as BSON arrays into packed binary blobs.
+
+Usage: python -m modules.backfill_embeddings [--batch-size 500] [--format float32|int8]
+
+Safe to rerun and to run while the app is serving: only entries whose vector is still
+an array are converted, so embeddings written in the meantime are never overwritten.
+"""
+
+import argparse
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+import modules.embedding_codec as embedding_codec
+from modules.db import connect_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--format",
+        choices=["float32", "int8"],
+        default=embedding_codec.STORAGE_FORMAT,
+        help="Storage format to convert to, defaults to EMBEDDING_STORAGE",
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    _, _, entries_collection = connect_db()
+    legacy = {"vector": {"$type": "array"}}
+    converted = 0
+    last_id = None
+    while True:
+        # Page by _id so each batch is a short indexed read
+        query = {**legacy, "_id": {"$gt": last_id}} if last_id else legacy
+        page = list(
+            entries_collection.find(query, {"vector": 1})
+            .sort("_id", 1)
+            .limit(args.batch_size)
+        )
+        if not page:
+            break
+        operations = [
+            UpdateOne(
+                {"_id": entry["_id"], **legacy},
+                {"$set": embedding_codec.encode(entry["vector"], args.format)},
+            )
+            for entry in page
+        ]
+        try:
+            result = entries_collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            print(f"❌ Backfill failed after entry {last_id}: {e}")
+            return
+        converted += result.modified_count
+        last_id = page[-1]["_id"]
+        print(f"✅ Converted {converted} embeddings to {args.format}")
+    print(f"✅ Backfill done, {converted} embeddings converted to {args.format}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Sets `text_length` on diary entries saved before it was stored with each submit.
+
+Usage: python -m modules.backfill_text_lengths [--batch-size 500]
+
+Safe to rerun and to run while the app is serving: only entries without a length are
+updated, and the length is computed from the entry's current text.
+"""
+
+import argparse
+
+from dotenv import load_dotenv
+
+from modules.db import connect_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    load_dotenv()
+    _, _, entries_collection = connect_db()
+    missing = {"text_length": {"$exists": False}}
+    updated = 0
+    last_id = None
+    while True:
+        # Page by _id so each batch is a short indexed read
+        query = {**missing, "_id": {"$gt": last_id}} if last_id else missing
+        ids = [
+            entry["_id"]
+            for entry in entries_collection.find(query, {"_id": 1})
+            .sort("_id", 1)
+            .limit(args.batch_size)
+        ]
+        if not ids:
+            break
+        try:
+            result = entries_collection.update_many(
+                {**missing, "_id": {"$in": ids}},
+                [{"$set": {"text_length": {"$strLenCP": {"$ifNull": ["$text", ""]}}}}],
+            )
+        except Exception as e:
+            print(f"❌ Backfill failed after entry {last_id}: {e}")
+            return
+        updated += result.modified_count
+        last_id = ids[-1]
+        print(f"✅ Text length set on {updated} entries")
+    print(f"✅ Backfill done, text length set on {updated} entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,116 @@
-import json
-from datetime import datetime, timedelta
-from typing import Any
+import email.utils
+import os
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
 
 import fasthtml.common as fh
-import numpy as np
-import pandas as pd
-from openai import OpenAI
-from pymongo.collection import Collection
-from sklearn.linear_model import LinearRegression
+from motor.motor_asyncio import AsyncIOMotorCollection
 
+import modules.downsampling as downsampling
+import modules.entries_repository as entries_repository
+import modules.entry_cache as entry_cache
+import modules.exemplars as exemplars
+import modules.feature_model as feature_model
+import modules.llm_cache as llm_cache
+import modules.score_rollups as score_rollups
+import modules.streaming as streaming
+import modules.summaries as summaries
+import modules.text_fingerprint as text_fingerprint
 import prompts_and_schemas.diary_feature_analysis as diary_feature_analysis
-import prompts_and_schemas.diary_prompt as diary_prompt
+from modules.llm_backend import LLMBackend
 
+# Most points a chart gets by default, long histories are downsampled to this many
+PLOT_POINTS = int(os.getenv("DASHBOARD_PLOT_POINTS", "500"))
+# Version of the figures `plot_data` builds, part of their ETag
+PLOT_FORMAT = 1
 
-def plot_diary_data(session: dict, users_collection: Collection):
-    def _make_plot(plot_data, div_id: str) -> fh.FT:
-        div_id = div_id.replace(" ", "-")
-        json_data = json.dumps(plot_data)
-        return fh.Div(id=div_id), fh.Script(f"Plotly.newPlot('{div_id}', {json_data});")
+PLOT_CONFIG = {
+    "modeBarButtonsToRemove": [
+        "zoom2d",
+        "pan2d",
+        "select2d",
+        "zoom",
+        "resetScale2d",
+        "zoomIn2d",
+        "zoomOut2d",
+    ]
+}
+
+
+async def _get_rollup(
+    user_id: str,
+    entries_collection: AsyncIOMotorCollection,
+    rollups_collection: AsyncIOMotorCollection,
+) -> dict:
+    # Reads the per-user rollup instead of the entries themselves
+    return await entry_cache.cached(
+        user_id,
+        ("rollup",),
+        lambda: score_rollups.get_rollup(
+            rollups_collection, entries_collection, user_id
+        ),
+    )
+
+
+async def plot_diary_data(
+    session: dict,
+    entries_collection: AsyncIOMotorCollection,
+    rollups_collection: AsyncIOMotorCollection,
+):
+    def _make_plot(kind: str) -> fh.FT:
+        # The figure is fetched from `/dashboard/plot_data`, where the browser can cache it
+        div_id = f"{kind}-plot"
+        return fh.Div(id=div_id), fh.Script(
+            f"fetch('/dashboard/plot_data?kind={kind}&points={PLOT_POINTS}')"
+            ".then((response) => response.json())"
+            f".then((figure) => Plotly.newPlot('{div_id}', figure));"
+        )
 
     user_id = session["user_info"]["id"]
-    user: dict = users_collection.find_one({"google_id": user_id})
-    diary_entries: list[dict[str, int | list[dict[str, int]] | Any]] = sorted(
-        user.get("diary_entries"), key=lambda x: x.get("created_at", "")
+    rollup = await _get_rollup(user_id, entries_collection, rollups_collection)
+
+    # The rollup keeps the regression's sufficient statistics up to date on every
+    # submit, so finding the most important feature does not depend on the history length
+    feature = feature_model.most_important(rollup["feature_model"])
+    if feature:
+        optimize = (
+            fh.H1(f"The most important thing to optimize is {feature}"),
+            # Both completions stream in token by token over SSE
+            streaming.sse_target(f"/improvement_suggestions_stream?feature={feature}"),
+        )
+    else:
+        optimize = (fh.H1("Analyze an entry to find out what to optimize"),)
+    return (
+        fh.A("Main", href="/"),
+        *optimize,
+        fh.H1("Weekly Summary"),
+        streaming.sse_target("/weekly_summary_stream"),
+        fh.H1("Monthly Summary"),
+        streaming.sse_target("/monthly_summary_stream"),
+        fh.H1("All Time Performance"),
+        _make_plot("days"),
+        fh.H1("Weekly Averages"),
+        _make_plot("weeks"),
     )
 
-    dates: list[int] = []
-    analysis_scores: list[dict[str, int]] = [{} for _ in diary_entries]
+
+def _day_traces(days: dict[str, dict[str, int]]) -> list[dict]:
+    dates: list[str] = sorted(days)
+    analysis_scores: list[dict[str, int]] = []
     happiness_scores: list[int] = []
     types_of_analysis: set[str] = set()
-    for i, diary in enumerate(diary_entries):
-        happiness_scores.append(diary.get("happiness_score", 0))
-        dates.append(str(diary.get("created_at")))
-        analysis_types = diary.get("analysis", {})
-        for analysis_type in analysis_types.keys():
-            analysis_scores[i][analysis_type] = analysis_types[analysis_type].get(
-                "score", 0
-            )
-            types_of_analysis.add(analysis_type)
+    for date in dates:
+        scores = dict(days[date])
+        happiness_scores.append(scores.pop("happiness", 0))
+        analysis_scores.append(scores)
+        types_of_analysis.update(scores)
 
     data = []
     data.append(
         {"x": dates, "y": happiness_scores, "type": "scatter", "name": "happiness"}
     )
 
-    scores_per_analysis_type: dict[str, int] = {}
-    for analysis_type in types_of_analysis:
+    for analysis_type in sorted(types_of_analysis):
         current_analysis_type_scores: list[int] = []
         for analysis_score in analysis_scores:
             current_analysis_type_scores.append(analysis_score.get(analysis_type, 0))
@@ -57,95 +122,145 @@ def plot_diary_data(session: dict, users_collection: Collection):
                 "name": analysis_type,
             }
         )
-        scores_per_analysis_type[analysis_type] = current_analysis_type_scores
-    plot_data = {
-        "data": data,
-        "layout": {"title": data},
-        "config": {
-            "modeBarButtonsToRemove": [
-                "zoom2d",
-                "pan2d",
-                "select2d",
-                "zoom",
-                "resetScale2d",
-                "zoomIn2d",
-                "zoomOut2d",
-            ]
-        },
+    return data
+
+
+def _period_traces(periods: dict[str, dict[str, dict]]) -> list[dict]:
+    """Mean of every score per period, from the rollup's week or month summaries."""
+    keys = sorted(periods)
+    metrics = sorted({metric for key in keys for metric in periods[key]})
+    return [
+        {
+            "x": keys,
+            "y": [periods[key].get(metric, {}).get("mean") for key in keys],
+            "type": "scatter",
+            "name": metric,
+        }
+        for metric in metrics
+    ]
+
+
+def _downsample(trace: dict, kind: str, points: int) -> dict:
+    """Keeps `points` points of the trace, chosen by LTTB over the time between them."""
+    present = [i for i, y in enumerate(trace["y"]) if y is not None]
+    if len(present) <= points:
+        return trace
+    # Days and ISO weeks both map to day ordinals, so gaps in the history count as time
+    key_format = "%Y-%m-%d" if kind == "days" else "%G-W%V-%u"
+    suffix = "" if kind == "days" else "-1"
+    xs = [
+        datetime.strptime(trace["x"][i] + suffix, key_format).toordinal()
+        for i in present
+    ]
+    ys = [trace["y"][i] for i in present]
+    kept = [present[i] for i in downsampling.lttb(xs, ys, points)]
+    return {
+        **trace,
+        "x": [trace["x"][i] for i in kept],
+        "y": [trace["y"][i] for i in kept],
     }
 
-    # finding the most important feature
-    X: pd.DataFrame = pd.DataFrame(scores_per_analysis_type)
-    y: pd.DataFrame = pd.DataFrame(
-        np.array(happiness_scores), columns=["happiness_score"]
-    )
-    model = LinearRegression()
-    model.fit(X, y)
-    coefficients = pd.DataFrame(
-        {"Feature": X.columns, "Coefficient": model.coef_.ravel()}
-    ).sort_values(by="Coefficient", ascending=False)
-    return (
-        fh.A("Main", href="/"),
-        fh.H1(
-            f"The most important thing to optimize is {coefficients.iloc[0]['Feature']}"
-        ),
-        fh.Div(
-            hx_indicator="#improvement-suggestions-spinner",
-            hx_trigger="load",
-            hx_swap="innerHTML",
-            hx_get=f"/improvement_suggestions?feature={coefficients.iloc[0]['Feature']}",
-        ),
-        fh.Div(
-            id="improvement-suggestions-spinner",
-            data_uk_spinner=True,
-            cls="htmx-indicator",
-        ),
-        fh.H1("Weekly Summary"),
-        fh.Div(
-            hx_indicator="#weekly-goals-spinner",
-            hx_trigger="load",
-            hx_swap="innerHTML",
-            hx_get="/weekly_summary",
-        ),
-        fh.Div(
-            id="weekly-goals-spinner",
-            data_uk_spinner=True,
-            cls="htmx-indicator",
-        ),
-        fh.H1("All Time Performance"),
-        _make_plot(plot_data, "plot"),
+
+def _http_date(moment: datetime) -> str:
+    # Naive times are UTC from `$currentDate`, aware ones are converted
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return email.utils.format_datetime(moment.astimezone(timezone.utc), usegmt=True)
+
+
+def _not_modified(req: fh.Request, etag: str, last_modified: Optional[str]) -> bool:
+    # If-None-Match takes precedence, If-Modified-Since is only for clients without ETags
+    if_none_match = req.headers.get("if-none-match")
+    if if_none_match:
+        return etag in [tag.strip() for tag in if_none_match.split(",")]
+    if_modified_since = req.headers.get("if-modified-since")
+    if not if_modified_since or not last_modified:
+        return False
+    try:
+        return email.utils.parsedate_to_datetime(
+            if_modified_since
+        ) >= email.utils.parsedate_to_datetime(last_modified)
+    except (TypeError, ValueError):
+        return False
+
+
+async def plot_data(
+    req: fh.Request,
+    kind: str,
+    points: int,
+    session: dict,
+    entries_collection: AsyncIOMotorCollection,
+    rollups_collection: AsyncIOMotorCollection,
+) -> fh.Response:
+    """The Plotly figure of the `days` scores or the `weeks` means, as JSON.
+
+    Its ETag and Last-Modified follow the user's entries, so a dashboard reloaded without
+    new entries gets a 304 without the rollup being read.
+
+    Args:
+        kind (str): "days" or "weeks"
+        points (int): Most points per trace, 0 to send every point
+    """
+    if kind not in ("days", "weeks"):
+        return fh.JSONResponse({"error": f"Unknown plot {kind}"}, status_code=400)
+    user_id = session["user_info"]["id"]
+    version, updated_at = await entry_cache.get_version(user_id)
+    if updated_at is None:
+        # Users whose entries have not changed since the stamp was added
+        created_at = await entries_repository.latest_created_at(
+            entries_collection, user_id
+        )
+        # `created_at` is the server's local time
+        updated_at = created_at.astimezone() if created_at else None
+    # The version only counts one user's writes, the id hash keeps another user's
+    # validator from matching after an account switch in the same browser
+    user_tag = text_fingerprint.content_hash(user_id)[:16]
+    etag = f'"{PLOT_FORMAT}-{user_tag}-{version}-{kind}-{points}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        # The response depends on who the session cookie belongs to
+        "Vary": "Cookie",
+    }
+    if updated_at:
+        headers["Last-Modified"] = _http_date(updated_at)
+
+    if _not_modified(req, etag, headers.get("Last-Modified")):
+        return fh.Response(status_code=304, headers=headers)
+
+    rollup = await _get_rollup(user_id, entries_collection, rollups_collection)
+    if kind == "days":
+        title, data = "All Time Performance", _day_traces(rollup["days"])
+    else:
+        title, data = "Weekly Averages", _period_traces(rollup["weeks"])
+    if points:
+        data = [_downsample(trace, kind, points) for trace in data]
+    return fh.JSONResponse(
+        {"data": data, "layout": {"title": {"text": title}}, "config": PLOT_CONFIG},
+        headers=headers,
     )
 
 
-def improvement_suggestions(
+async def _improvement_suggestions_message(
     feature: str,
-    openai_client: OpenAI,
     session: dict,
-    users_collection: Collection,
-):
+    entries_collection: AsyncIOMotorCollection,
+    rollups_collection: AsyncIOMotorCollection,
+) -> str:
     def get_entries(
-        diary_entries: list[dict[str, int | list[dict[str, int]] | Any]],
-        feature: str,
-        context_length: int,
-        min_length: int,
-        best: bool,
+        diary_entries: list[dict[str, str | dict[str, dict]]], feature: str
     ) -> list[dict[str, list | str]]:
         entries = []
-        slice = (
-            diary_entries[: context_length + 1]
-            if best
-            else diary_entries[context_length:]
-        )
-        for entry in slice:
-            if len(entry.get("text", "")) > min_length:
-                entries.append(
-                    {
-                        "text": entry.get("text", ""),
-                        "feature": feature,
-                        "suggestions": entry.get(feature, {}).get("suggestions", []),
-                        "explanation": entry.get(feature, {}).get("explanation", ""),
-                    }
-                )
+        for entry in diary_entries:
+            analysis = entry.get("analysis", {}).get(feature, {})
+            entries.append(
+                {
+                    "text": entry.get("text", ""),
+                    "feature": feature,
+                    "suggestions": analysis.get("suggestions", []),
+                    "explanation": analysis.get("explanation", ""),
+                }
+            )
         return entries
 
     def _make_prompt(
@@ -183,102 +298,125 @@ def improvement_suggestions(
         </suggestions>
     </entry>
             """
-        prompt += "<worst-entries>"
+        prompt += "</worst-entries>"
+        return prompt
 
     user_id = session["user_info"]["id"]
-    user: dict = users_collection.find_one({"google_id": user_id})
-    diary_entries: list[dict[str, int | list[dict[str, int]] | Any]] = sorted(
-        user.get("diary_entries"),
-        key=lambda x: x.get("analysis", {}).get(feature, {}).get("score", 0),
-        reverse=True,
-    )
-    CONTEXT_LENGTH = 5
-    MIN_LENGTH = 100
-    # TODO: length check
+
+    async def exemplar_entries(best: bool) -> list[dict]:
+        # Read by date off the exemplar index kept up to date by each analysis
+        return await entry_cache.cached(
+            user_id,
+            ("exemplars", feature, best),
+            lambda: exemplars.top(
+                rollups_collection,
+                entries_collection,
+                user_id,
+                feature,
+                best,
+                {"_id": 0, "text": 1, f"analysis.{feature}": 1},
+            ),
+        )
+
     best: list[dict[str, list | str]] = get_entries(
-        diary_entries, feature, CONTEXT_LENGTH, MIN_LENGTH, best=True
+        await exemplar_entries(True), feature
     )
     worst: list[dict[str, list | str]] = get_entries(
-        diary_entries, feature, CONTEXT_LENGTH, MIN_LENGTH, best=False
+        await exemplar_entries(False), feature
     )
     prompt = _make_prompt(best, worst, feature)
-    improvement_suggestions_response = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": diary_feature_analysis.diary_feature_analysis_system_prompt,
-            },
-            {
-                "role": "user",
-                "content": f"""These are some of my past diary entries which demonstrate my best and worst days relative to this metric: {feature}\nPlease give me some suggestions on how to improve\n{prompt}""",
-            },
-        ],
+    return f"""These are some of my past diary entries which demonstrate my best and worst days relative to this metric: {feature}\nPlease give me some suggestions on how to improve\n{prompt}"""
+
+
+async def improvement_suggestions(
+    feature: str,
+    llm: LLMBackend,
+    session: dict,
+    entries_collection: AsyncIOMotorCollection,
+    rollups_collection: AsyncIOMotorCollection,
+):
+    # Only known features may key the exemplar index in the rollup
+    if feature not in feature_model.FEATURES:
+        return fh.P(f"Unknown feature: {feature}", style="color: red;")
+    improvement_suggestions_response = await llm_cache.chat(
+        llm,
+        "gpt-4o-mini",
+        diary_feature_analysis.diary_feature_analysis_system_prompt,
+        await _improvement_suggestions_message(
+            feature, session, entries_collection, rollups_collection
+        ),
     )
-    return fh.P(improvement_suggestions_response.choices[0].message.content)
+    return fh.P(improvement_suggestions_response)
 
 
-def weekly_summary(
-    openai_client: OpenAI,
+async def improvement_suggestions_stream(
+    feature: str,
+    llm: LLMBackend,
+    session: dict,
+    entries_collection: AsyncIOMotorCollection,
+    rollups_collection: AsyncIOMotorCollection,
+) -> AsyncIterator[str]:
+    if feature not in feature_model.FEATURES:
+        return streaming.sse_text(f"Unknown feature: {feature}")
+    return streaming.sse_tokens(
+        llm_cache.chat_stream(
+            llm,
+            "gpt-4o-mini",
+            diary_feature_analysis.diary_feature_analysis_system_prompt,
+            await _improvement_suggestions_message(
+                feature, session, entries_collection, rollups_collection
+            ),
+        )
+    )
+
+
+async def weekly_summary(
+    llm: LLMBackend,
     session: dict,
-    users_collection: Collection,
+    entries_collection: AsyncIOMotorCollection,
+    summaries_collection: AsyncIOMotorCollection,
 ):
-    user_id = session["user_info"]["id"]
-    user: dict = users_collection.find_one({"google_id": user_id})
-    diary_entries: list[dict[str, int | list[dict[str, int]] | Any]] = sorted(
-        user.get("diary_entries"), key=lambda x: x.get("created_at", ""), reverse=True
+    weekly_summary_response = await summaries.week_summary(
+        llm,
+        summaries_collection,
+        entries_collection,
+        session["user_info"]["id"],
+        summaries.week_key(datetime.now().date()),
     )
-    week_entries = []
-    one_week_ago = datetime.now() - timedelta(weeks=1)
-    for entry in diary_entries:
-        if entry.get("created_at", datetime.min) <= one_week_ago:
-            break
-        week_entries.append(entry)
-
-    prompt = "<entries>\n"
-    for entry in week_entries:
-        prompt += f"""
-    <entry>
-        <text>\n{entry.get("text", "")}\n</text>
-        <happiness_score>{entry.get("happiness_score", 0)}</happiness_score>
-        <analysis>
-            <socialization>
-                {entry.get("analysis", {}).get("socialization", {}).get("explanation")}
-                <suggestions>
-                    {[f"<suggestion>{suggestion}</suggestion>" for suggestion in entry.get("analysis", {}).get("socialization", {}).get("suggestions", [])]}
-                </suggestions>
-            </socialization>
-            <productivity>
-                {entry.get("analysis", {}).get("productivity", {}).get("explanation")}
-                <suggestions>
-                    {[f"<suggestion>{suggestion}</suggestion>" for suggestion in entry.get("analysis", {}).get("productivity", {}).get("suggestions", [])]}
-                </suggestions>
-            </productivity>
-            <fulfillment>
-                {entry.get("analysis", {}).get("fulfillment", {}).get("explanation")}
-                <suggestions>
-                    {[f"<suggestion>{suggestion}</suggestion>" for suggestion in entry.get("analysis", {}).get("fulfillment", {}).get("suggestions", [])]}
-                </suggestions>
-            </fulillment>
-            <health>
-                {entry.get("analysis", {}).get("health", {}).get("explanation")}
-                <suggestions>
-                    {[f"<suggestion>{suggestion}</suggestion>" for suggestion in entry.get("analysis", {}).get("health", {}).get("suggestions", [])]}
-                </suggestions>
-            </health>
-        </analysis>
-    </entry>
-        """
-    prompt += "</entries>"
-    print(prompt)
-    weekly_summary_response = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": diary_prompt.weekly_summary_system_prompt},
-            {
-                "role": "user",
-                "content": f"""These are some of my past diary entries from this week. Give me a goal to pursue\n{prompt}""",
-            },
-        ],
+    return fh.P(weekly_summary_response or "No entries yet this week.")
+
+
+async def weekly_summary_stream(
+    llm: LLMBackend,
+    session: dict,
+    entries_collection: AsyncIOMotorCollection,
+    summaries_collection: AsyncIOMotorCollection,
+) -> AsyncIterator[str]:
+    # Built from the week's entry digests, and only generated again when one changes
+    return streaming.sse_tokens(
+        summaries.week_summary_stream(
+            llm,
+            summaries_collection,
+            entries_collection,
+            session["user_info"]["id"],
+            summaries.week_key(datetime.now().date()),
+        )
+    )
+
+
+async def monthly_summary_stream(
+    llm: LLMBackend,
+    session: dict,
+    entries_collection: AsyncIOMotorCollection,
+    summaries_collection: AsyncIOMotorCollection,
+) -> AsyncIterator[str]:
+    # Built from the month's weekly summaries rather than its entries
+    return streaming.sse_tokens(
+        summaries.month_summary_stream(
+            llm,
+            summaries_collection,
+            entries_collection,
+            session["user_info"]["id"],
+            datetime.now().strftime("%Y-%m"),
+        )
     )
-    return fh.P(weekly_summary_response.choices[0].message.content)
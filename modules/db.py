@@ -1,40 +1,80 @@
 import os
 
+from motor.motor_asyncio import (
+    AsyncIOMotorClient,
+    AsyncIOMotorCollection,
+    AsyncIOMotorDatabase,
+)
 from pymongo import MongoClient
 from pymongo.collection import Collection
 from pymongo.database import Database
-from pymongo.errors import ConnectionFailure
+from pymongo.errors import ConnectionFailure, PyMongoError
 
+CLIENT_OPTIONS = {
+    "maxPoolSize": 50,
+    "connectTimeoutMS": 30000,
+    "serverSelectionTimeoutMS": 5000,
+}
 
-def init_db() -> tuple[Database, Collection]:
-    mongo_uri = os.getenv("MONGO_DB_URI")
 
-    try:
-        client: MongoClient = MongoClient(
-            mongo_uri,
-            maxPoolSize=50,
-            connectTimeoutMS=30000,
-            serverSelectionTimeoutMS=5000,
-        )
+def init_db() -> tuple[Database, Collection, Collection]:
+    """Creates the blocking client, which connects in the background on first use.
+
+    Nothing here waits on the network, `check_connection` and `create_indexes` are run
+    by the startup thread once the server is listening.
+    """
+    client: MongoClient = MongoClient(os.getenv("MONGO_DB_URI"), **CLIENT_OPTIONS)
+    db = client["write2meDB"]
+    users_collection: Collection = db["users"]
+    entries_collection: Collection = db["diary_entries"]
+    return db, users_collection, entries_collection
+
 
-        client.admin.command("ping")
-        print("✅ Successfully connected to MongoDB Atlas")
+def check_connection(db: Database) -> None:
+    """Raises `ConnectionFailure` when MongoDB cannot be reached."""
+    db.client.admin.command("ping")
+    print("✅ Successfully connected to MongoDB Atlas")
 
+
+def create_indexes(
+    users_collection: Collection, entries_collection: Collection
+) -> None:
+    """Raises when an index cannot be created, so the startup step is retried."""
+    # Create standard indexes
+    users_collection.create_index("google_id", unique=True)
+    users_collection.create_index("email", unique=True)
+    users_collection.create_index([("last_login", -1)])
+    # One entry per user per day
+    entries_collection.create_index([("google_id", 1), ("date", 1)], unique=True)
+    entries_collection.create_index([("google_id", 1), ("created_at", -1)])
+    print("✅ Database indexes created")
+
+
+def connect_db() -> tuple[Database, Collection, Collection]:
+    """`init_db` for scripts, which wait for the connection and indexes before starting."""
+    db, users_collection, entries_collection = init_db()
+    try:
+        check_connection(db)
     except ConnectionFailure as e:
         print(f"❌ MongoDB connection failed: {e}")
         raise SystemExit(1)
-
-    db = client["write2meDB"]
-    users_collection: Collection = db["users"]
-
     try:
-        # Create standard indexes
-        users_collection.create_index("google_id", unique=True)
-        users_collection.create_index("email", unique=True)
-        users_collection.create_index([("last_login", -1)])
-        print("✅ Database indexes created")
-
-    except Exception as e:
+        create_indexes(users_collection, entries_collection)
+    except PyMongoError as e:
         print(f"❌ Index creation failed: {e}")
+        raise SystemExit(1)
+    return db, users_collection, entries_collection
+
 
-    return db, users_collection
+def init_async_db() -> (
+    tuple[AsyncIOMotorDatabase, AsyncIOMotorCollection, AsyncIOMotorCollection]
+):
+    """Motor counterpart of `init_db` for the async request handlers.
+
+    Uses the same pool settings. The connection check and indexes are left to the blocking
+    client, which the background workers still need, as Motor only connects inside the
+    event loop.
+    """
+    client = AsyncIOMotorClient(os.getenv("MONGO_DB_URI"), **CLIENT_OPTIONS)
+    db = client["write2meDB"]
+    return db, db["users"], db["diary_entries"]
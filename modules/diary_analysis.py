@@ -1,289 +1,549 @@
+import functools
+import json
+import os
 import statistics
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import AsyncIterator, Optional
 
 import fasthtml.common as fh
 import fasthtml.components as fh_components
-from openai import OpenAI
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pydantic import BaseModel
+from pymongo import ReturnDocument
 from pymongo.collection import Collection
 
 import js_css_loader
+import modules.analysis_queue as analysis_queue
+import modules.embedding_codec as embedding_codec
+import modules.entries_repository as entries_repository
+import modules.entry_cache as entry_cache
+import modules.exemplars as exemplars
+import modules.llm_cache as llm_cache
+import modules.prompt_coalescer as prompt_coalescer
+import modules.prompt_drafts as prompt_drafts
+import modules.score_rollups as score_rollups
+import modules.streaming as streaming
+import modules.text_fingerprint as text_fingerprint
+import modules.vector_index as vector_index
 import prompts_and_schemas.diary_prompt as diary_prompt
 import prompts_and_schemas.diary_responses as diary_responses
+from modules.llm_backend import LLMBackend
 
+# (analysis key, accordion title, system prompt, user request, response schema)
+CATEGORIES: list[tuple[str, str, str, str, type]] = [
+    (
+        "socialization",
+        "Socialization",
+        diary_responses.socialization_system_prompt,
+        "tell me how well I socialized today",
+        diary_responses.SocializationScore,
+    ),
+    (
+        "productivity",
+        "Productivity",
+        diary_responses.productivity_system_prompt,
+        "tell me how well productive I was today",
+        diary_responses.ProductivityScore,
+    ),
+    (
+        "fulfillment",
+        "Fulfillment",
+        diary_responses.fulfillment_system_prompt,
+        "tell me how well I achieved self fulfillment",
+        diary_responses.FulfillmentScore,
+    ),
+    (
+        "health",
+        "Health",
+        diary_responses.health_system_prompt,
+        "tell me how healthy I was today",
+        diary_responses.HealthScore,
+    ),
+]
 
-def category_analysis(
-    text: str,
-    happiness_score: int,
-    openai_client: OpenAI,
-    session: dict,
-    users_collection: Collection,
-):
-    """Displays the scores/info for various categories, given a submitted diary entry.
+# Shared across requests so concurrent submits cannot open unbounded connections to the LLM API
+analysis_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ANALYSIS_MAX_WORKERS", "16")),
+    thread_name_prefix="diary-analysis",
+)
+
+# "fanout" sends one request per category, "combined" scores every category in a single call
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "fanout")
+if ANALYSIS_MODE not in ("fanout", "combined"):
+    raise ValueError(
+        f"ANALYSIS_MODE must be 'fanout' or 'combined', not {ANALYSIS_MODE!r}"
+    )
+_COMBINED_REQUEST = "score every category for today"
+
+# Resubmits that changed fewer characters than this (in total) reuse the previous scores
+REANALYSIS_EDIT_THRESHOLD = int(os.getenv("REANALYSIS_EDIT_THRESHOLD", "40"))
 
-    Args:
-        text (str): User submitted entry
-        happiness_score (int): User submitted happiness
+
+def _score_request(text: str, request: str) -> str:
+    return f"This is my dairy, {request}:\n<diary-entry>\n{text}\n</dairy-entry>"
+
+
+def score_categories(
+    text: str, llm: LLMBackend, keys: Optional[list[str]] = None
+) -> dict[str, BaseModel]:
+    """Scores the entry for the `keys` categories (all by default), according to `ANALYSIS_MODE`.
 
     Returns:
-        fh.FT: HTML components in the form of a franken ui accordion: https://next.franken-ui.dev/docs/2.0/accordion
+        dict[str, BaseModel]: Parsed `*Score` response keyed by analysis category
     """
-    scores = []
-
-    def _make_accordian_title(title: str) -> fh.FT:
-        return (
-            fh.A(cls="uk-accordion-title", href=True)(
-                title,
-                fh.Span(cls="uk-accordion-icon")(
-                    fh_components.Uk_icon(icon="chevron-down"),
-                ),
-            ),
+    if ANALYSIS_MODE == "combined":
+        # The diary text is only sent (and billed) once for all four categories
+        parsed = llm_cache.parse(
+            llm,
+            "gpt-4o-mini",
+            diary_responses.combined_system_prompt,
+            _score_request(text, _COMBINED_REQUEST),
+            diary_responses.DiaryAnalysis,
         )
+        return {
+            key: getattr(parsed, key)
+            for key, *_ in CATEGORIES
+            if keys is None or key in keys
+        }
 
-    def _make_accordian_content(explaination: str, suggestions: list[str]) -> fh.FT:
-        # uk-list-hyphen is a filled hyphen marker: https://next.franken-ui.dev/docs/2.0/list
-        return (
-            fh.Div(cls="uk-accordion-content")(
-                fh.P(f"Explaination: {explaination}"),
-                fh.P("Suggestions:"),
-                fh.Ul(cls="uk-list uk-list-hyphen")(
-                    *[fh.Li(suggestion) for suggestion in suggestions]
-                ),
-            ),
+    score_futures = {
+        key: analysis_executor.submit(
+            llm_cache.parse,
+            llm,
+            "gpt-4o-mini",
+            system_prompt,
+            _score_request(text, request),
+            response_format,
         )
+        for key, _, system_prompt, request, response_format in CATEGORIES
+        if keys is None or key in keys
+    }
+    return {key: future.result() for key, future in score_futures.items()}
 
-    socialization_score_response = openai_client.beta.chat.completions.parse(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": diary_responses.socialization_system_prompt,
-            },
-            {
-                "role": "user",
-                "content": f"This is my dairy, tell me how well I socialized today:\n<diary-entry>\n{text}\n</dairy-entry>",
-            },
-        ],
-        response_format=diary_responses.SocializationScore,
-    )
-    socialization_accordion_element = fh.Li(cls="uk-open")(
-        _make_accordian_title(
-            f"Socialization Score: {socialization_score_response.choices[0].message.parsed.score}"
-        ),
-        _make_accordian_content(
-            socialization_score_response.choices[0].message.parsed.reason,
-            socialization_score_response.choices[
-                0
-            ].message.parsed.improvement_suggestions,
-        ),
-    )
-    scores.append(socialization_score_response.choices[0].message.parsed.score)
 
-    productivity_score_response = openai_client.beta.chat.completions.parse(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": diary_responses.productivity_system_prompt,
-            },
-            {
-                "role": "user",
-                "content": f"This is my dairy, tell me how well productive I was today:\n<diary-entry>\n{text}\n</dairy-entry>",
-            },
-        ],
-        response_format=diary_responses.ProductivityScore,
+def entry_digest(text: str, llm: LLMBackend) -> str:
+    """A two sentence digest of the entry, which summaries read instead of its text."""
+    return llm_cache.chat_sync(
+        llm, "gpt-4o-mini", diary_prompt.entry_digest_system_prompt, text
     )
-    productivity_accordion_element = fh.Li(cls="uk-open")(
-        _make_accordian_title(
-            f"Productivity Score: {productivity_score_response.choices[0].message.parsed.score}"
-        ),
-        _make_accordian_content(
-            productivity_score_response.choices[0].message.parsed.reason,
-            productivity_score_response.choices[
-                0
-            ].message.parsed.improvement_suggestions,
+
+
+def _make_accordian_title(title: str) -> fh.FT:
+    return (
+        fh.A(cls="uk-accordion-title", href=True)(
+            title,
+            fh.Span(cls="uk-accordion-icon")(
+                fh_components.Uk_icon(icon="chevron-down"),
+            ),
         ),
     )
 
-    scores.append(productivity_score_response.choices[0].message.parsed.score)
 
-    fulfillment_score_response = openai_client.beta.chat.completions.parse(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": diary_responses.fulfillment_system_prompt,
-            },
-            {
-                "role": "user",
-                "content": f"This is my dairy, tell me how well I achieved self fulfillment:\n<diary-entry>\n{text}\n</dairy-entry>",
-            },
-        ],
-        response_format=diary_responses.FulfillmentScore,
-    )
-    fulfillment_accordion_element = fh.Li(cls="uk-open")(
-        _make_accordian_title(
-            f"Fulfillment Score: {fulfillment_score_response.choices[0].message.parsed.score}"
-        ),
-        _make_accordian_content(
-            fulfillment_score_response.choices[0].message.parsed.reason,
-            fulfillment_score_response.choices[
-                0
-            ].message.parsed.improvement_suggestions,
+def _make_accordian_content(explaination: str, suggestions: list[str]) -> fh.FT:
+    # uk-list-hyphen is a filled hyphen marker: https://next.franken-ui.dev/docs/2.0/list
+    return (
+        fh.Div(cls="uk-accordion-content")(
+            fh.P(f"Explaination: {explaination}"),
+            fh.P("Suggestions:"),
+            fh.Ul(cls="uk-list uk-list-hyphen")(
+                *[fh.Li(suggestion) for suggestion in suggestions or []]
+            ),
         ),
     )
-    scores.append(fulfillment_score_response.choices[0].message.parsed.score)
 
-    health_score_response = openai_client.beta.chat.completions.parse(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": diary_responses.health_system_prompt,
-            },
-            {
-                "role": "user",
-                "content": f"This is my dairy, tell me how healthy I was today:\n<diary-entry>\n{text}\n</dairy-entry>",
-            },
-        ],
-        response_format=diary_responses.HealthScore,
+
+def render_analysis(analysis: dict) -> fh.FT:
+    """Displays the scores/info for various categories of an analyzed diary entry.
+
+    Returns:
+        fh.FT: HTML components in the form of a franken ui accordion: https://next.franken-ui.dev/docs/2.0/accordion
+    """
+    scores = []
+    accordion_elements = []
+    for key, title, *_ in CATEGORIES:
+        category = analysis[key]
+        accordion_elements.append(
+            fh.Li(cls="uk-open")(
+                _make_accordian_title(f"{title} Score: {category['score']}"),
+                _make_accordian_content(
+                    category["explanation"], category["suggestions"]
+                ),
+            )
+        )
+        scores.append(category["score"])
+
+    return fh.Ul(cls="uk-accordion", data_uk_accordion="multiple: true")(
+        *accordion_elements
+    ), fh.P(f"Average Score: {statistics.mean(scores)}")
+
+
+def _analysis_poller(job_id: str) -> fh.FT:
+    # Swaps itself out for the analysis once the job is done
+    return fh.Div(
+        hx_get=f"/analysis_status?job_id={job_id}",
+        hx_trigger="every 2s",
+        hx_swap="outerHTML",
+    )(
+        fh.Div(data_uk_spinner=True),
+        fh.P("Analyzing your entry..."),
     )
-    health_accordion_element = fh.Li(cls="uk-open")(
-        _make_accordian_title(
-            f"Health Score: {health_score_response.choices[0].message.parsed.score}"
-        ),
-        _make_accordian_content(
-            health_score_response.choices[0].message.parsed.reason,
-            health_score_response.choices[0].message.parsed.improvement_suggestions,
-        ),
+
+
+@functools.cache
+def _category_signature(key: str) -> str:
+    # Everything besides the text that determines a category's result in `ANALYSIS_MODE`
+    for category_key, _, system_prompt, request, response_format in CATEGORIES:
+        if category_key != key:
+            continue
+        if ANALYSIS_MODE == "combined":
+            signature = [
+                "gpt-4o-mini",
+                diary_responses.combined_system_prompt,
+                _COMBINED_REQUEST,
+                diary_responses.DiaryAnalysis.model_json_schema(),
+                key,
+            ]
+        else:
+            signature = [
+                "gpt-4o-mini",
+                system_prompt,
+                request,
+                response_format.model_json_schema(),
+            ]
+        return json.dumps(signature, sort_keys=True)
+    raise KeyError(key)
+
+
+def _category_fingerprint(key: str, text: str) -> str:
+    return text_fingerprint.content_hash(_category_signature(key) + text)
+
+
+def analyze_entry(text: str, llm: LLMBackend, previous: Optional[dict] = None) -> dict:
+    """Scores the categories of a diary entry and embeds its text, reusing what it can.
+
+    Args:
+        previous (Optional[dict]): The last analyzed version of the entry, with its `text`,
+            `content_hash`, `fingerprints`, `unanalyzed_edit_chars` and `has_digest`
+
+    Returns:
+        dict: Entry fields to set, containing only the analysis that had to be recomputed
+    """
+    text_hash = text_fingerprint.content_hash(text)
+    fingerprints = {key: _category_fingerprint(key, text) for key, *_ in CATEGORIES}
+    stale = list(fingerprints)
+    unanalyzed_edit_chars = 0
+    if previous:
+        unanalyzed_edit_chars = previous.get(
+            "unanalyzed_edit_chars", 0
+        ) + text_fingerprint.changed_chars(previous["text"], text)
+        if unanalyzed_edit_chars <= REANALYSIS_EDIT_THRESHOLD:
+            # Small edits keep each result unless its prompt, model or schema changed
+            stale = [
+                key
+                for key in fingerprints
+                if previous.get("fingerprints", {}).get(key)
+                != _category_fingerprint(key, previous["text"])
+            ]
+    if len(stale) == len(fingerprints):
+        unanalyzed_edit_chars = 0
+
+    fields = {
+        "content_hash": text_hash,
+        "analysis_fingerprints": fingerprints,
+        "unanalyzed_edit_chars": unanalyzed_edit_chars,
+    }
+    vector_future = None
+    digest_future = None
+    if not previous or previous["content_hash"] != text_hash:
+        # Start the embedding first so it overlaps with the category scoring
+        vector_future = analysis_executor.submit(
+            llm.embed, text, "text-embedding-3-large"
+        )
+    if vector_future or not previous.get("has_digest"):
+        digest_future = analysis_executor.submit(entry_digest, text, llm)
+    if stale:
+        parsed_scores = score_categories(text, llm, stale)
+        for key, parsed in parsed_scores.items():
+            fields[f"analysis.{key}"] = {
+                "score": parsed.score,
+                "explanation": parsed.reason,
+                "suggestions": parsed.improvement_suggestions,
+            }
+    if vector_future:
+        fields.update(embedding_codec.encode(vector_future.result()))
+    if digest_future:
+        fields["digest"] = digest_future.result()
+    print(
+        f"♻️ Reanalyzed {len(stale)}/{len(fingerprints)} categories, "
+        f"{'new' if vector_future else 'reused'} embedding, "
+        f"{'new' if digest_future else 'reused'} digest"
     )
-    scores.append(health_score_response.choices[0].message.parsed.score)
+    return fields
+
+
+def _reusable_analysis(entry: Optional[dict]) -> Optional[dict]:
+    # Only an entry whose stored analysis was computed from its current text can be reused
+    if not entry or entry.get("content_hash") != text_fingerprint.content_hash(
+        entry.get("text", "")
+    ):
+        return None
+    return {
+        "text": entry["text"],
+        "content_hash": entry["content_hash"],
+        "fingerprints": entry.get("analysis_fingerprints", {}),
+        "unanalyzed_edit_chars": entry.get("unanalyzed_edit_chars", 0),
+        "has_digest": entry.get("digest") is not None,
+    }
 
+
+async def category_analysis(
+    text: str,
+    happiness_score: int,
+    session: dict,
+    entries_collection: AsyncIOMotorCollection,
+    jobs_collection: AsyncIOMotorCollection,
+    rollups_collection: AsyncIOMotorCollection,
+):
+    """Stores a submitted diary entry and queues its analysis.
+
+    Args:
+        text (str): User submitted entry
+        happiness_score (int): User submitted happiness
+
+    Returns:
+        fh.FT: A placeholder that polls `/analysis_status` until the analysis is ready
+    """
     if "user_info" not in session or not session["user_info"].get("email"):
         return fh.P(
             "Error: You must be logged in to submit entries.", style="color: red;"
         )
 
-    # Ensure the `google_id` uniquely identifies the user
     user_id = session["user_info"]["id"]
-    user = users_collection.find_one({"google_id": user_id})
 
-    if not user:
-        return fh.P("Error: User not found. Please log in again.", style="color: red;")
-
-    # Store diary entry in MongoDB
+    # Store the raw diary entry in MongoDB, the analysis is filled in by a worker
     try:
-        # Ensure `diary_entry` is a proper dictionary
-        diary_entry = {
-            "text": text,
-            "happiness_score": happiness_score,
-            "analysis": {
-                "socialization": {
-                    "score": socialization_score_response.choices[
-                        0
-                    ].message.parsed.score,
-                    "explanation": socialization_score_response.choices[
-                        0
-                    ].message.parsed.reason,
-                    "suggestions": socialization_score_response.choices[
-                        0
-                    ].message.parsed.improvement_suggestions,
-                },
-                "productivity": {
-                    "score": productivity_score_response.choices[
-                        0
-                    ].message.parsed.score,
-                    "explanation": productivity_score_response.choices[
-                        0
-                    ].message.parsed.reason,
-                    "suggestions": productivity_score_response.choices[
-                        0
-                    ].message.parsed.improvement_suggestions,
-                },
-                "fulfillment": {
-                    "score": fulfillment_score_response.choices[0].message.parsed.score,
-                    "explanation": fulfillment_score_response.choices[
-                        0
-                    ].message.parsed.reason,
-                    "suggestions": fulfillment_score_response.choices[
-                        0
-                    ].message.parsed.improvement_suggestions,
-                },
-                "health": {
-                    "score": health_score_response.choices[0].message.parsed.score,
-                    "explanation": health_score_response.choices[
-                        0
-                    ].message.parsed.reason,
-                    "suggestions": health_score_response.choices[
-                        0
-                    ].message.parsed.improvement_suggestions,
-                },
-            },
-            "created_at": datetime.now(),  # Ensure `datetime` is serialized properly
-            "date": datetime.now().strftime("%Y-%m-%d"),
-            "vector": openai_client.embeddings.create(
-                input=text, model="text-embedding-3-large"
-            )
-            .data[0]
-            .embedding,
-        }
-
         today_date = datetime.now().strftime("%Y-%m-%d")
-        users_collection.update_one(
-            {
-                "google_id": user_id,
-                "diary_entries.date": today_date,
-            },
+        created_at = datetime.now()  # Ensure `datetime` is serialized properly
+        # One atomic upsert on the unique (google_id, date) index, so concurrent submits
+        # of the same day update a single entry. Returns the entry as it was before.
+        previous_entry = await entries_collection.find_one_and_update(
+            {"google_id": user_id, "date": today_date},
             {
                 "$set": {
-                    "diary_entries.$.text": diary_entry["text"],
-                    "diary_entries.$.happiness_score": diary_entry["happiness_score"],
-                    "diary_entries.$.analysis": diary_entry["analysis"],
-                    "diary_entries.$.created_at": diary_entry["created_at"],
-                }
+                    "text": text,
+                    # Lets rankings filter out short entries from an index
+                    "text_length": len(text),
+                    "happiness_score": happiness_score,
+                    "created_at": created_at,
+                    "analysis_status": "pending",
+                },
+                "$setOnInsert": {"analysis": {}},
+            },
+            projection={
+                "text": 1,
+                "content_hash": 1,
+                "analysis_fingerprints": 1,
+                "unanalyzed_edit_chars": 1,
+                "digest": 1,
             },
-            upsert=False,
-        )
-
-        users_collection.update_one(
-            {"google_id": user_id, "diary_entries.date": {"$ne": today_date}},
-            {"$push": {"diary_entries": {**diary_entry, "date": today_date}}},
             upsert=True,
         )
+        await score_rollups.record_async(
+            rollups_collection, user_id, today_date, {"happiness": happiness_score}
+        )
+        await entry_cache.invalidate_async(user_id)
+        previous = _reusable_analysis(previous_entry)
+        job_id = await analysis_queue.enqueue(
+            jobs_collection, user_id, today_date, text, previous
+        )
         print(f"✅ Diary entry saved for user {user_id}")
     except Exception as e:
         print(f"🔥 Failed to save diary entry: {e}")
+        return fh.P("Error: Could not save your entry.", style="color: red;")
 
-    return fh.Ul(cls="uk-accordion", data_uk_accordion="multiple: true")(
-        socialization_accordion_element,
-        productivity_accordion_element,
-        fulfillment_accordion_element,
-        health_accordion_element,
-    ), fh.P(f"Average Score: {statistics.mean(scores)}")
+    return _analysis_poller(job_id)
 
 
-def prompt_user(text: str, openai_client: OpenAI) -> fh.FT:
-    diary_prompt_response = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
+def process_analysis_job(
+    job: dict,
+    llm: LLMBackend,
+    entries_collection: Collection,
+    rollups_collection: Collection,
+) -> None:
+    """Runs the analysis of a queued entry and writes it back to that entry."""
+    fields = analyze_entry(job["text"], llm, job.get("previous"))
+    # Only write back if the entry was not resubmitted since this job was queued
+    entry = entries_collection.find_one_and_update(
+        {"google_id": job["google_id"], "date": job["date"], "text": job["text"]},
+        {"$set": {**fields, "analysis_status": "done"}},
+        projection={
+            "_id": 0,
+            **{f"analysis.{key}.score": 1 for key, *_ in CATEGORIES},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    if entry:
+        vector_index.upsert(
+            job["google_id"], job["date"], job["text"], embedding_codec.decode(fields)
+        )
+        score_rollups.record(
+            rollups_collection,
+            job["google_id"],
+            job["date"],
             {
-                "role": "system",
-                "content": diary_prompt.diary_prompt_system_prompt,
+                key: fields[f"analysis.{key}"]["score"]
+                for key, *_ in CATEGORIES
+                if f"analysis.{key}" in fields
             },
+        )
+        # Every score, the reused ones included, as the text may have crossed the length cut
+        exemplars.record(
+            rollups_collection,
+            job["google_id"],
+            job["date"],
             {
-                "role": "user",
-                "content": f"This is my dairy that is still in progress. Tell me what to improve:\n<diary-entry>\n{text}\n</dairy-entry>",
+                key: analysis["score"]
+                for key, analysis in entry.get("analysis", {}).items()
             },
-        ],
+            job["text"],
+        )
+        entry_cache.invalidate(job["google_id"])
+        print(f"✅ Diary entry analyzed for user {job['google_id']}")
+    else:
+        print(f"⚠️ Skipped stale analysis for user {job['google_id']}")
+
+
+def fail_analysis_job(job: dict, entries_collection: Collection) -> None:
+    """Marks the entry of a job that failed its last attempt as not analyzed."""
+    # Left alone if the entry was resubmitted since this job was queued
+    result = entries_collection.update_one(
+        {
+            "google_id": job["google_id"],
+            "date": job["date"],
+            "text": job["text"],
+            "analysis_status": "pending",
+        },
+        {"$set": {"analysis_status": "failed"}},
+    )
+    if result.modified_count:
+        entry_cache.invalidate(job["google_id"])
+
+
+async def analysis_status(
+    job_id: str,
+    session: dict,
+    entries_collection: AsyncIOMotorCollection,
+    jobs_collection: AsyncIOMotorCollection,
+) -> fh.FT:
+    user_id = session["user_info"]["id"]
+    job = await analysis_queue.get_job(jobs_collection, job_id, user_id)
+    if not job:
+        return fh.P("Error: Analysis not found.", style="color: red;")
+    if job["status"] in ("pending", "running"):
+        return _analysis_poller(job_id)
+    if job["status"] == "failed":
+        return fh.P(
+            "Error: Your entry was saved but could not be analyzed.",
+            style="color: red;",
+        )
+    if job["status"] == "superseded":
+        return fh.P("A newer submission for this day replaced this one.")
+
+    entry = await entries_repository.entry_by_date(
+        entries_collection, user_id, job["date"], {"_id": 0, "analysis": 1}
+    )
+    if not entry or not entry.get("analysis"):
+        return fh.P("A newer submission for this day replaced this one.")
+    return render_analysis(entry["analysis"])
+
+
+def _prompt_user_message(text: str) -> str:
+    return f"This is my dairy that is still in progress. Tell me what to improve:\n<diary-entry>\n{text}\n</dairy-entry>"
+
+
+async def prompt_user(
+    text: str,
+    llm: LLMBackend,
+    session: dict,
+    drafts_collection: AsyncIOMotorCollection,
+) -> fh.FT:
+    key = prompt_coalescer.session_key(session)
+    if not prompt_coalescer.submit(key, text):
+        # Draft barely changed since the last prompt, keep showing that one
+        return fh.Response(status_code=204)
+
+    # A newer draft, possibly posted to another process, cancels this prompt
+    draft_id = await prompt_drafts.save(drafts_collection, key, text)
+    diary_prompt_response = await prompt_drafts.call_while_latest(
+        drafts_collection,
+        key,
+        draft_id,
+        llm_cache.chat(
+            llm,
+            "gpt-4o-mini",
+            diary_prompt.diary_prompt_system_prompt,
+            _prompt_user_message(text),
+        ),
     )
+    if diary_prompt_response is None:
+        return fh.Response(status_code=204)
     return fh.H2(
         fh.Style(
-            js_css_loader.styles["span_inherit_h2.css"]
+            js_css_loader.load_styles()["span_inherit_h2.css"]
         ),  # make the spans inherit the h2 style
         fh.Span(
-            fh.Span(diary_prompt_response.choices[0].message.content),
+            fh.Span(diary_prompt_response),
             fh.Style(  # css only typewriter effect: https://dev.to/afif/a-scalable-css-only-typewriter-effect-2opn
                 # gnat css-scope-inline: https://github.com/gnat/css-scope-inline
-                js_css_loader.styles["prompt_user_typewriter.css"]
+                js_css_loader.load_styles()["prompt_user_typewriter.css"]
             ),
         ),
     )
+
+
+async def prompt_user_stream_target(
+    text: str, session: dict, drafts_collection: AsyncIOMotorCollection
+) -> fh.FT:
+    """Stores the draft and returns an element that streams the prompt for it."""
+    key = prompt_coalescer.session_key(session)
+    if not prompt_coalescer.submit(key, text):
+        # Draft barely changed since the last prompt, keep showing that one
+        return fh.Response(status_code=204)
+
+    # The EventSource may reach another server process, which reads the draft back
+    draft_id = await prompt_drafts.save(drafts_collection, key, text)
+    return fh.H2(
+        fh.Style(
+            js_css_loader.load_styles()["span_inherit_h2.css"]
+        ),  # make the spans inherit the h2 style
+        streaming.sse_target(
+            f"/prompt_user_stream?draft_id={draft_id}", element=fh.Span
+        ),
+    )
+
+
+async def prompt_user_stream(
+    draft_id: str,
+    session: dict,
+    llm: LLMBackend,
+    drafts_collection: AsyncIOMotorCollection,
+) -> AsyncIterator[str]:
+    key = prompt_coalescer.session_key(session)
+    text = await prompt_drafts.take(drafts_collection, key, draft_id)
+    if text is None:
+        # Already streamed or superseded, or the EventSource reconnecting
+        return streaming.sse_close()
+    return streaming.sse_tokens(
+        prompt_drafts.while_latest(
+            drafts_collection,
+            key,
+            draft_id,
+            llm_cache.chat_stream(
+                llm,
+                "gpt-4o-mini",
+                diary_prompt.diary_prompt_system_prompt,
+                _prompt_user_message(text),
+            ),
+        )
+    )
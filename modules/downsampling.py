@@ -0,0 +1,43 @@
+import numpy as np
+
+
+def lttb(xs: list[float], ys: list[float], points: int) -> list[int]:
+    """Largest-Triangle-Three-Buckets, the indices of `points` points that keep the shape.
+
+    The first and last points are always kept. The rest are split into `points - 2`
+    buckets and each keeps the point that forms the largest triangle with the point kept
+    from the previous bucket and the mean of the next one, so peaks and dips survive.
+
+    Args:
+        xs (list[float]): Increasing x values
+        ys (list[float]): y value of each x
+        points (int): Target number of points, every point is kept when there are fewer
+
+    Returns:
+        list[int]: Increasing indices into `xs` and `ys`
+    """
+    count = len(xs)
+    if points >= count or points < 3:
+        return list(range(count))
+    x = np.asarray(xs, dtype=np.float64)
+    y = np.asarray(ys, dtype=np.float64)
+    # Bucket boundaries over the points between the first and the last
+    edges = np.linspace(1, count - 1, points - 1).astype(int).tolist()
+    kept = [0]
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+        else:
+            next_start, next_end = count - 1, count
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+        previous = kept[-1]
+        # Twice the triangle area, the constant factor does not change the largest one
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        kept.append(start + int(areas.argmax()))
+    kept.append(count - 1)
+    return kept
@@ -0,0 +1,49 @@
+import os
+from typing import Optional
+
+import numpy as np
+from bson.binary import USER_DEFINED_SUBTYPE, Binary
+
+# "float32" keeps search results identical, "int8" stores a quarter of the bytes
+STORAGE_FORMAT = os.getenv("EMBEDDING_STORAGE", "float32")
+
+FLOAT32_SUBTYPE = USER_DEFINED_SUBTYPE
+INT8_SUBTYPE = USER_DEFINED_SUBTYPE + 1
+
+
+def encode(vector: list[float], storage_format: str = STORAGE_FORMAT) -> dict:
+    """Packs an embedding into a BSON binary blob.
+
+    Args:
+        vector (list[float]): Embedding as returned by the backend
+        storage_format (str): "float32", or "int8" for symmetric scalar quantization
+
+    Returns:
+        dict: Entry fields to set, `vector` and for int8 also its `vector_scale`
+    """
+    values = np.asarray(vector, dtype=np.float32)
+    if storage_format == "int8":
+        scale = float(np.abs(values).max()) / 127 or 1.0
+        quantized = np.round(values / scale).astype(np.int8)
+        return {
+            "vector": Binary(quantized.tobytes(), INT8_SUBTYPE),
+            "vector_scale": scale,
+        }
+    return {"vector": Binary(values.astype("<f4").tobytes(), FLOAT32_SUBTYPE)}
+
+
+def decode(entry: dict) -> Optional[np.ndarray]:
+    """Reads the embedding of an entry into float32 without per-element Python objects.
+
+    Entries written before the binary format still hold a plain array, which is converted.
+    """
+    vector = entry.get("vector")
+    if vector is None:
+        return None
+    if isinstance(vector, Binary):
+        if vector.subtype == INT8_SUBTYPE:
+            return np.frombuffer(vector, dtype=np.int8).astype(np.float32) * np.float32(
+                entry["vector_scale"]
+            )
+        return np.frombuffer(vector, dtype="<f4")
+    return np.asarray(vector, dtype=np.float32)
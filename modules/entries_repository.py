@@ -0,0 +1,271 @@
+from datetime import datetime
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.collection import Collection
+
+# What pages show of an entry, leaving out the vector and the analysis bookkeeping
+DISPLAY_FIELDS = {
+    "_id": 0,
+    "date": 1,
+    "text": 1,
+    "happiness_score": 1,
+    "analysis": 1,
+    "analysis_status": 1,
+    "created_at": 1,
+}
+
+
+async def score_series(
+    entries_collection: AsyncIOMotorCollection, google_id: str
+) -> list[dict]:
+    """Happiness and per-category scores of every entry, oldest first.
+
+    Returns:
+        list[dict]: `date`, `created_at`, `happiness_score` and `scores` ({category: score}) per entry
+    """
+    cursor = entries_collection.aggregate(
+        [
+            {"$match": {"google_id": google_id}},
+            {"$sort": {"created_at": 1}},
+            {
+                "$project": {
+                    "_id": 0,
+                    "date": 1,
+                    "created_at": 1,
+                    "happiness_score": 1,
+                    "scores": {
+                        "$arrayToObject": {
+                            "$map": {
+                                "input": {
+                                    "$objectToArray": {"$ifNull": ["$analysis", {}]}
+                                },
+                                "in": {"k": "$$this.k", "v": "$$this.v.score"},
+                            }
+                        }
+                    },
+                }
+            },
+        ]
+    )
+    return await cursor.to_list(None)
+
+
+async def search_vectors(
+    entries_collection: AsyncIOMotorCollection, google_id: str, preview_length: int
+) -> list[dict]:
+    """Embedded entries with their `date`, `vector` (and `vector_scale`) and the start of their
+    text as `preview`."""
+    cursor = entries_collection.aggregate(
+        [
+            {
+                "$match": {
+                    "google_id": google_id,
+                    "vector": {"$type": ["binData", "array"]},
+                }
+            },
+            {
+                "$project": {
+                    "_id": 0,
+                    "date": 1,
+                    "vector": 1,
+                    "vector_scale": 1,
+                    "preview": {
+                        "$substrCP": [{"$ifNull": ["$text", ""]}, 0, preview_length]
+                    },
+                }
+            },
+        ]
+    )
+    return await cursor.to_list(None)
+
+
+async def entry_by_date(
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    date: str,
+    fields: Optional[dict] = None,
+) -> Optional[dict]:
+    """The user's entry for `date` with only `fields`, or the display fields by default."""
+    return await entries_collection.find_one(
+        {"google_id": google_id, "date": date}, fields or DISPLAY_FIELDS
+    )
+
+
+async def entries_by_dates(
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    dates: list[str],
+    fields: dict,
+) -> list[dict]:
+    """The user's entries for `dates`, in that order, each an exact (google_id, date) lookup."""
+    cursor = entries_collection.find(
+        {"google_id": google_id, "date": {"$in": dates}}, {**fields, "date": 1}
+    )
+    by_date = {entry["date"]: entry for entry in await cursor.to_list(None)}
+    return [by_date[date] for date in dates if date in by_date]
+
+
+async def month_entries(
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    month: str,
+    preview_length: int,
+) -> list[dict]:
+    """Entries dated in `month` ("YYYY-MM"), oldest first, with the start of their text as `preview`.
+
+    Dates are "YYYY-MM-DD" strings, so the month is one range scan on the (google_id, date) index.
+    """
+    cursor = entries_collection.aggregate(
+        [
+            {
+                "$match": {
+                    "google_id": google_id,
+                    "date": {"$gte": f"{month}-01", "$lte": f"{month}-31"},
+                }
+            },
+            {"$sort": {"date": 1}},
+            {
+                "$project": {
+                    "_id": 0,
+                    "date": 1,
+                    "happiness_score": 1,
+                    "preview": {
+                        "$substrCP": [{"$ifNull": ["$text", ""]}, 0, preview_length]
+                    },
+                }
+            },
+        ]
+    )
+    return await cursor.to_list(None)
+
+
+async def ranked_by_feature(
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    feature: str,
+    limit: int,
+    min_text_length: int,
+    best: bool,
+) -> list[dict]:
+    """The `limit` highest (or lowest) scored entries for `feature`, sorted and cut in the database.
+
+    Only entries longer than `min_text_length` are considered, and each comes back with
+    just its `date`, `text` and the analysis of `feature`. Ties go to the newest entry for
+    the best and the oldest for the worst, so one index serves both directions.
+    """
+    score = f"analysis.{feature}.score"
+    direction = -1 if best else 1
+    cursor = (
+        entries_collection.find(
+            {
+                "google_id": google_id,
+                score: {"$exists": True},
+                "text_length": {"$gt": min_text_length},
+            },
+            {"_id": 0, "date": 1, "text": 1, f"analysis.{feature}": 1},
+        )
+        .sort([(score, direction), ("date", direction)])
+        .limit(limit)
+    )
+    return await cursor.to_list(None)
+
+
+def create_feature_indexes(entries_collection: Collection, features: list[str]) -> None:
+    """Indexes each feature's score per user, so ranking entries by it reads only the top.
+
+    The date breaks ties in the sort and the text length is filtered on from the index
+    keys, so a ranking never sorts in memory or reads the entries it skips.
+    """
+    for feature in features:
+        entries_collection.create_index(
+            [
+                ("google_id", 1),
+                (f"analysis.{feature}.score", 1),
+                ("date", 1),
+                ("text_length", 1),
+            ]
+        )
+        # Replaced by the index above, which also serves the sort and the filter
+        legacy = f"google_id_1_analysis.{feature}.score_-1"
+        if legacy in entries_collection.index_information():
+            entries_collection.drop_index(legacy)
+    print("✅ Feature score indexes created")
+
+
+async def history_page(
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    before: Optional[datetime],
+    limit: int,
+) -> list[dict]:
+    """One page of the history, newest first, starting after the `before` cursor.
+
+    Seeks on the (google_id, created_at) index, so a page costs the same however deep it is.
+    """
+    query: dict = {"google_id": google_id}
+    if before:
+        query["created_at"] = {"$lt": before}
+    cursor = (
+        entries_collection.find(query, DISPLAY_FIELDS)
+        .sort("created_at", -1)
+        .limit(limit)
+    )
+    return await cursor.to_list(None)
+
+
+async def latest_created_at(
+    entries_collection: AsyncIOMotorCollection, google_id: str
+) -> Optional[datetime]:
+    """When the user's newest entry was written, off the (google_id, created_at) index."""
+    entry = await entries_collection.find_one(
+        {"google_id": google_id},
+        {"_id": 0, "created_at": 1},
+        sort=[("created_at", -1)],
+    )
+    return entry["created_at"] if entry else None
+
+
+async def period_digests(
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    first_date: str,
+    last_date: str,
+    preview_length: int,
+) -> list[dict]:
+    """`date`, `happiness_score` and `digest` of the entries from `first_date` to `last_date`.
+
+    Entries without a digest yet fall back to the start of their text. The dates are one
+    range scan on the (google_id, date) index.
+    """
+    cursor = entries_collection.aggregate(
+        [
+            {
+                "$match": {
+                    "google_id": google_id,
+                    "date": {"$gte": first_date, "$lte": last_date},
+                }
+            },
+            {"$sort": {"date": 1}},
+            {
+                "$project": {
+                    "_id": 0,
+                    "date": 1,
+                    "happiness_score": 1,
+                    "digest": {
+                        "$ifNull": [
+                            "$digest",
+                            {
+                                "$substrCP": [
+                                    {"$ifNull": ["$text", ""]},
+                                    0,
+                                    preview_length,
+                                ]
+                            },
+                        ]
+                    },
+                }
+            },
+        ]
+    )
+    return await cursor.to_list(None)
@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Optional
+
+import bson
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.collection import Collection
+
+MAX_BYTES = int(os.getenv("ENTRY_CACHE_MAX_MB", "64")) * 1024 * 1024
+TTL_SECONDS = int(os.getenv("ENTRY_CACHE_TTL_SECONDS", "300"))
+
+# google_id -> (entries version the values were read at, {read key: (expires_at, value, bytes)})
+_users: OrderedDict[str, tuple[int, dict[tuple, tuple[float, Any, int]]]] = (
+    OrderedDict()
+)
+_lock = threading.Lock()
+_bytes = 0
+# `entries_version` and `entries_updated_at` live on the user document, so every process
+# sees the same stamp
+_versions_collection: Optional[Collection] = None
+_async_versions_collection: Optional[AsyncIOMotorCollection] = None
+
+_VERSION_UPDATE = {
+    "$inc": {"entries_version": 1},
+    "$currentDate": {"entries_updated_at": True},
+}
+
+stats: dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "stale": 0,
+    "evictions": 0,
+}
+
+
+def init_entry_cache(
+    users_collection: Collection, async_users_collection: AsyncIOMotorCollection
+) -> None:
+    global _versions_collection, _async_versions_collection
+    _versions_collection = users_collection
+    _async_versions_collection = async_users_collection
+
+
+def get_stats() -> dict[str, float]:
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        **stats,
+        "hit_rate": stats["hits"] / lookups if lookups else 0.0,
+        "users": len(_users),
+        "bytes": _bytes,
+    }
+
+
+def _drop(google_id: str) -> None:
+    global _bytes
+    _, values = _users.pop(google_id, (0, {}))
+    _bytes -= sum(size for *_, size in values.values())
+
+
+def _size(value: Any) -> int:
+    try:
+        return len(bson.encode({"value": value}))
+    except Exception:
+        return 1024
+
+
+async def get_version(google_id: str) -> tuple[int, Optional[datetime]]:
+    """The user's `entries_version`, and the UTC time their entries last changed if known."""
+    if _async_versions_collection is None:
+        return 0, None
+    user = await _async_versions_collection.find_one(
+        {"google_id": google_id},
+        {"_id": 0, "entries_version": 1, "entries_updated_at": 1},
+    )
+    user = user or {}
+    return user.get("entries_version", 0), user.get("entries_updated_at")
+
+
+async def cached(google_id: str, key: tuple, load: Callable[[], Awaitable[Any]]) -> Any:
+    """Returns the user's entry data for `key`, calling `load` when it is not cached.
+
+    Each lookup reads the user's `entries_version`, a single indexed field, and drops
+    everything cached for the user when another process has written their entries since.
+    Cached values are shared between requests and must not be modified.
+    """
+    global _bytes
+    version, _ = await get_version(google_id)
+
+    with _lock:
+        cached_version, values = _users.get(google_id, (version, {}))
+        if cached_version != version:
+            stats["stale"] += 1
+            _drop(google_id)
+            values = {}
+        hit = values.get(key)
+        if hit and hit[0] > time.time():
+            _users.move_to_end(google_id)
+            stats["hits"] += 1
+            return hit[1]
+        stats["misses"] += 1
+
+    value = await load()
+    size = _size(value)
+    with _lock:
+        cached_version, values = _users.get(google_id, (version, {}))
+        if cached_version != version:
+            # Invalidated while loading, the value may already be outdated
+            return value
+        if key in values:
+            _bytes -= values[key][2]
+        values[key] = (time.time() + TTL_SECONDS, value, size)
+        _bytes += size
+        _users[google_id] = (version, values)
+        _users.move_to_end(google_id)
+        while _bytes > MAX_BYTES and len(_users) > 1:
+            evicted = next(iter(_users))
+            _drop(evicted)
+            stats["evictions"] += 1
+    return value
+
+
+def invalidate(google_id: str) -> None:
+    """Marks the user's entries as changed, for writes made outside the request handlers."""
+    with _lock:
+        _drop(google_id)
+    if _versions_collection is not None:
+        _versions_collection.update_one({"google_id": google_id}, _VERSION_UPDATE)
+
+
+async def invalidate_async(google_id: str) -> None:
+    """`invalidate` for the async request handlers."""
+    with _lock:
+        _drop(google_id)
+    if _async_versions_collection is not None:
+        await _async_versions_collection.update_one(
+            {"google_id": google_id}, _VERSION_UPDATE
+        )
@@ -0,0 +1,156 @@
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+
+import modules.entries_repository as entries_repository
+
+# Best and worst entries shown for a feature
+COUNT = 5
+# Shorter entries say too little to learn from
+MIN_TEXT_LENGTH = 100
+# Kept on each side, so entries can drop out of the top without a rebuild
+CAPACITY = 2 * COUNT
+SIDES = ("best", "worst")
+
+# Each feature's index lives in the user's score rollup as `exemplars.{feature}`:
+# {"best": [{"date", "score"}, ...], "worst": [...], "whole": bool}. Each side is the exact
+# top of the user's entries, and `whole` means it holds every entry that qualifies.
+
+
+def _ranks_above(item: dict, other: dict, side: str) -> bool:
+    # Same order as `ranked_by_feature`: by score, then newest first for the best and
+    # oldest first for the worst
+    if side == "best":
+        return (item["score"], item["date"]) > (other["score"], other["date"])
+    return (item["score"], item["date"]) < (other["score"], other["date"])
+
+
+def _updated(index: dict, date: str, score: Optional[int]) -> dict:
+    """`index` with the entry for `date` moved to `score`, or removed when `score` is None.
+
+    An entry that falls below everything kept cannot be placed without knowing the entries
+    past the end, so it is dropped and that side gets one shorter.
+    """
+    updated: dict = {"whole": index["whole"]}
+    for side in SIDES:
+        rest = [item for item in index[side] if item["date"] != date]
+        item = {"date": date, "score": score}
+        if score is not None and (
+            index["whole"] or (rest and _ranks_above(item, rest[-1], side))
+        ):
+            rest = sorted(
+                [*rest, item],
+                key=lambda kept: (kept["score"], kept["date"]),
+                reverse=side == "best",
+            )
+            if len(rest) > CAPACITY:
+                updated["whole"] = False
+        updated[side] = rest[:CAPACITY]
+    return updated
+
+
+def record(
+    rollups_collection: Collection,
+    google_id: str,
+    date: str,
+    scores: dict[str, int],
+    text: str,
+) -> None:
+    """Moves the entry for `date` within each feature's index, in O(K) per feature.
+
+    Args:
+        scores (dict[str, int]): Every current category score of the entry
+        text (str): The entry's text, which decides whether it qualifies
+    """
+    # Bumping the epoch first makes an index rebuilt from entries read before this
+    # write fail to store, see `_rebuild`
+    rollup = rollups_collection.find_one_and_update(
+        {"_id": google_id},
+        {"$inc": {"exemplars_epoch": 1}},
+        projection={"exemplars": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    qualifies = len(text) > MIN_TEXT_LENGTH
+    for feature, score in scores.items():
+        index = ((rollup or {}).get("exemplars") or {}).get(feature)
+        if index is None:
+            # Built from the entries the first time it is read
+            continue
+        result = rollups_collection.update_one(
+            {"_id": google_id, f"exemplars.{feature}": index},
+            {
+                "$set": {
+                    f"exemplars.{feature}": _updated(
+                        index, date, score if qualifies else None
+                    )
+                }
+            },
+        )
+        if not result.matched_count:
+            # Another write got there first, rebuild it on the next read instead
+            rollups_collection.update_one(
+                {"_id": google_id}, {"$unset": {f"exemplars.{feature}": ""}}
+            )
+
+
+async def _rebuild(
+    rollups_collection: AsyncIOMotorCollection,
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    feature: str,
+    epoch: Optional[int],
+) -> dict:
+    """Builds the index of `feature` off the feature score index, for histories written before it."""
+    index: dict = {}
+    for side in SIDES:
+        entries = await entries_repository.ranked_by_feature(
+            entries_collection,
+            google_id,
+            feature,
+            CAPACITY,
+            MIN_TEXT_LENGTH,
+            side == "best",
+        )
+        index[side] = [
+            {"date": entry["date"], "score": entry["analysis"][feature]["score"]}
+            for entry in entries
+        ]
+    index["whole"] = len(index["best"]) < CAPACITY
+    # Not stored if an entry was analyzed meanwhile, as it may be missing from the read
+    await rollups_collection.update_one(
+        {"_id": google_id, "exemplars_epoch": epoch},
+        {"$set": {f"exemplars.{feature}": index}},
+    )
+    print(f"✅ Rebuilt {feature} exemplars for user {google_id}")
+    return index
+
+
+async def top(
+    rollups_collection: AsyncIOMotorCollection,
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    feature: str,
+    best: bool,
+    fields: dict,
+) -> list[dict]:
+    """The `COUNT` best (or worst) entries for `feature`, with `fields`, read by date."""
+    side = "best" if best else "worst"
+    rollup = await rollups_collection.find_one(
+        {"_id": google_id}, {f"exemplars.{feature}": 1, "exemplars_epoch": 1}
+    )
+    rollup = rollup or {}
+    index = (rollup.get("exemplars") or {}).get(feature)
+    if not index or (not index["whole"] and len(index[side]) < COUNT):
+        index = await _rebuild(
+            rollups_collection,
+            entries_collection,
+            google_id,
+            feature,
+            rollup.get("exemplars_epoch"),
+        )
+    dates = [item["date"] for item in index[side][:COUNT]]
+    return await entries_repository.entries_by_dates(
+        entries_collection, google_id, dates, fields
+    )
@@ -0,0 +1,151 @@
+import os
+from datetime import date, datetime
+from typing import Optional
+
+import numpy as np
+
+import prompts_and_schemas.diary_responses as diary_responses
+
+# Category scores the happiness score is regressed on
+FEATURES: list[str] = list(diary_responses.DiaryAnalysis.model_fields)
+INTERCEPT = "intercept"
+# Added to the diagonal of XᵀX except for the intercept, 0 fits plain least squares
+RIDGE = float(os.getenv("FEATURE_MODEL_RIDGE", "0"))
+# Days after which an entry counts half as much as a new one, 0 weighs all entries equally
+HALF_LIFE_DAYS = float(os.getenv("FEATURE_MODEL_HALF_LIFE_DAYS", "0"))
+
+# Weights grow from the model's epoch instead of decaying from today, so adding an entry
+# never rescales the stored sums and every update stays a plain `$inc`. A day that would
+# weigh more than 2**_MAX_DOUBLINGS gets the model rebuilt from a later epoch instead.
+_MAX_DOUBLINGS = 64
+_COLUMNS = [INTERCEPT, *FEATURES]
+
+
+def _doublings(day: str, epoch: str) -> float:
+    if not HALF_LIFE_DAYS:
+        return 0.0
+    days = (
+        datetime.strptime(day, "%Y-%m-%d").date()
+        - datetime.strptime(epoch, "%Y-%m-%d").date()
+    ).days
+    return days / HALF_LIFE_DAYS
+
+
+def _weight(day: str, epoch: str) -> float:
+    # Days long before the epoch underflow to 0, they no longer count
+    return 2.0 ** _doublings(day, epoch)
+
+
+def _sample(scores: Optional[dict]) -> Optional[tuple[list[float], float]]:
+    # Only days with a happiness score and every category score are observations
+    scores = scores or {}
+    if scores.get("happiness") is None or any(
+        scores.get(feature) is None for feature in FEATURES
+    ):
+        return None
+    return [1.0, *(float(scores[feature]) for feature in FEATURES)], float(
+        scores["happiness"]
+    )
+
+
+def empty(epoch: str) -> dict:
+    return {
+        "half_life_days": HALF_LIFE_DAYS,
+        "epoch": epoch,
+        "count": 0,
+        "xtx": {a: {b: 0.0 for b in _COLUMNS} for a in _COLUMNS},
+        "xty": {a: 0.0 for a in _COLUMNS},
+    }
+
+
+def is_current(model: Optional[dict]) -> bool:
+    """Whether `model` was accumulated with the configured decay and can be updated."""
+    return (
+        bool(model)
+        and model.get("half_life_days") == HALF_LIFE_DAYS
+        and "epoch" in model
+    )
+
+
+def fits(model: dict, day: str) -> bool:
+    """Whether `day` can be weighed against the epoch of `model` without overflowing."""
+    return _doublings(day, model["epoch"]) <= _MAX_DOUBLINGS
+
+
+def increments(
+    day: str, before: Optional[dict], after: Optional[dict], epoch: str
+) -> dict:
+    """`$inc` fields that replace the day's `before` scores with its `after` scores.
+
+    Each update is O(k²) in the number of features, whatever the length of the history.
+    `day` must `fit` the model's `epoch`.
+
+    Returns:
+        dict: Increments keyed by their path under the model, empty if nothing changed
+    """
+    changes = []
+    old, new = _sample(before), _sample(after)
+    if old == new:
+        return {}
+    if old:
+        changes.append((old, -1))
+    if new:
+        changes.append((new, 1))
+
+    fields: dict[str, float] = {}
+    for (x, y), sign in changes:
+        fields["count"] = fields.get("count", 0) + sign
+        weight = sign * _weight(day, epoch)
+        for i, a in enumerate(_COLUMNS):
+            fields[f"xty.{a}"] = fields.get(f"xty.{a}", 0.0) + weight * x[i] * y
+            for j, b in enumerate(_COLUMNS):
+                fields[f"xtx.{a}.{b}"] = (
+                    fields.get(f"xtx.{a}.{b}", 0.0) + weight * x[i] * x[j]
+                )
+    return fields
+
+
+def build(days: dict[str, dict[str, int]]) -> dict:
+    """Accumulates the model from scratch over the scores of every day in a rollup.
+
+    The epoch is the latest day, so the weights start at most 1 and have the whole
+    `_MAX_DOUBLINGS` of headroom for the days to come.
+    """
+    model = empty(max(days, default=date.today().isoformat()))
+    for day, scores in days.items():
+        for path, value in increments(day, None, scores, model["epoch"]).items():
+            *parents, leaf = path.split(".")
+            target = model
+            for parent in parents:
+                target = target[parent]
+            target[leaf] += value
+    return model
+
+
+def solve(model: Optional[dict]) -> Optional[dict[str, float]]:
+    """Fits happiness to the category scores from the accumulated sufficient statistics.
+
+    Returns:
+        Optional[dict[str, float]]: Coefficient of each feature, None without observations
+    """
+    if not model or model["count"] <= 0:
+        return None
+    xtx = np.array([[model["xtx"][a][b] for b in _COLUMNS] for a in _COLUMNS])
+    xty = np.array([model["xty"][a] for a in _COLUMNS])
+    if xtx[0, 0] <= 0:
+        return None
+    # Rescale the weights to average 1 so the ridge penalty means the same with any decay
+    scale = model["count"] / xtx[0, 0]
+    penalty = RIDGE * np.eye(len(_COLUMNS))
+    penalty[0, 0] = 0.0
+    # lstsq returns the minimum norm fit when there are fewer entries than features
+    coefficients, *_ = np.linalg.lstsq(xtx * scale + penalty, xty * scale, rcond=None)
+    return dict(zip(FEATURES, coefficients[1:].tolist()))
+
+
+def most_important(model: Optional[dict]) -> Optional[str]:
+    """The feature with the largest coefficient, None until an entry has been analyzed."""
+    coefficients = solve(model)
+    if not coefficients:
+        return None
+    return max(coefficients, key=coefficients.__getitem__)
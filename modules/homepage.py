@@ -1,17 +1,121 @@
 from datetime import datetime
-from typing import Any
+from typing import Optional
+from urllib.parse import quote
 
 import fasthtml.common as fh
-import numpy as np
-from numpy.linalg import norm
-from openai import OpenAI
-from pymongo.collection import Collection
+from motor.motor_asyncio import AsyncIOMotorCollection
 
 import js_css_loader
+import modules.entries_repository as entries_repository
+import modules.entry_cache as entry_cache
+import modules.vector_index as vector_index
 from modules.auth import Auth
+from modules.llm_backend import LLMBackend
 
+HISTORY_PAGE_SIZE = 10
 
-def homepage(auth: Auth, session, users_collection: Collection):
+
+def _history_card(entry: dict) -> fh.FT:
+    missing_score = (
+        "Analysis Failed"
+        if entry.get("analysis_status") == "failed"
+        else "Pending Analysis"
+    )
+    return fh.Div(cls="uk-card uk-card-default uk-card-body")(
+        fh.H2(f"{entry['created_at'].strftime('%Y-%m-%d %H:%M')}"),
+        fh.P(f"User Input: {entry.get('text', 'No input stored')}"),
+        fh.P(f"Mood Score: {entry.get('happiness_score', 'Pending Analysis')}/5"),
+        fh.Details()(
+            fh.Summary("View Analysis Details"),
+            fh.Ul(cls="uk-list uk-list-hyphen")(
+                fh.Li(
+                    f"Social Score: {entry['analysis'].get('socialization', {}).get('score', missing_score)}"
+                ),
+                fh.Li(
+                    f"Social Explanation: {entry['analysis'].get('socialization', {}).get('explanation', 'N/A')}"
+                ),
+                fh.Li(
+                    f"Productivity Score: {entry['analysis'].get('productivity', {}).get('score', missing_score)}"
+                ),
+                fh.Li(
+                    f"Productivity Explanation: {entry['analysis'].get('productivity', {}).get('explanation', 'N/A')}"
+                ),
+                fh.Li(
+                    f"Fulfillment Score: {entry['analysis'].get('fulfillment', {}).get('score', missing_score)}"
+                ),
+                fh.Li(
+                    f"Fulfillment Explanation: {entry['analysis'].get('fulfillment', {}).get('explanation', 'N/A')}"
+                ),
+                fh.Li(
+                    f"Health Score: {entry['analysis'].get('health', {}).get('score', missing_score)}"
+                ),
+                fh.Li(
+                    f"Health Explanation: {entry['analysis'].get('health', {}).get('explanation', 'N/A')}"
+                ),
+            ),
+        ),
+        fh.Details()(
+            fh.Summary("Suggestions"),
+            fh.Ul(cls="uk-list uk-list-hyphen")(
+                *[
+                    fh.Li(f"Social: {suggestion}")
+                    for suggestion in entry["analysis"]
+                    .get("socialization", {})
+                    .get("suggestions", [])
+                ],
+                *[
+                    fh.Li(f"Productivity: {suggestion}")
+                    for suggestion in entry["analysis"]
+                    .get("productivity", {})
+                    .get("suggestions", [])
+                ],
+                *[
+                    fh.Li(f"Fulfillment: {suggestion}")
+                    for suggestion in entry["analysis"]
+                    .get("fulfillment", {})
+                    .get("suggestions", [])
+                ],
+                *[
+                    fh.Li(f"Health: {suggestion}")
+                    for suggestion in entry["analysis"]
+                    .get("health", {})
+                    .get("suggestions", [])
+                ],
+            ),
+        ),
+    )
+
+
+def _history_items(entries: list[dict]) -> list[fh.FT]:
+    """Cards for one page of the history, followed by a loader for the next page if any."""
+    items = [_history_card(entry) for entry in entries]
+    if len(entries) == HISTORY_PAGE_SIZE:
+        before = quote(entries[-1]["created_at"].isoformat())
+        items.append(
+            fh.Div(
+                hx_get=f"/history?before={before}",
+                hx_trigger="revealed",
+                hx_swap="outerHTML",
+            )(fh.Div(data_uk_spinner=True))
+        )
+    return items
+
+
+async def _history_page(
+    entries_collection: AsyncIOMotorCollection,
+    user_id: str,
+    before: Optional[datetime],
+) -> list[dict]:
+    return await entry_cache.cached(
+        user_id,
+        ("history", before),
+        lambda: entries_repository.history_page(
+            entries_collection, user_id, before, HISTORY_PAGE_SIZE
+        ),
+    )
+
+
+async def homepage(auth: Auth, session, entries_collection: AsyncIOMotorCollection):
     is_authenticated = bool(auth and session.get("user_info"))
     if not is_authenticated:
         return (
@@ -24,96 +128,9 @@ def homepage(auth: Auth, session, users_collection: Collection):
     diary_entries: list[dict[str, str | datetime | dict[str, str]] | None]
     if is_authenticated:
         user_id = session["user_info"]["id"]
-        user = users_collection.find_one(
-            {"google_id": user_id}, {"diary_entries": 1, "_id": 0}
-        )
-
-        if user and "diary_entries" in user:
-            diary_entries: list[dict[str, str | datetime | dict[str, str]] | None] = (
-                sorted(
-                    user["diary_entries"],
-                    key=lambda x: x.get("created_at", ""),
-                    reverse=True,
-                )
-            )
-        else:
-            diary_entries = []
+        # Only the first page is rendered inline, the rest loads as it scrolls into view
+        diary_entries = await _history_page(entries_collection, user_id, None)
 
-    history_entries = sorted(
-        diary_entries,  # Do not exclude today's entry
-        key=lambda x: x.get("created_at", datetime.min),
-        reverse=True,
-    )
-
-    history_items = []
-    for entry in history_entries:
-        history_items.append(
-            fh.Div(cls="uk-card uk-card-default uk-card-body")(
-                fh.H2(f"{entry['created_at'].strftime('%Y-%m-%d %H:%M')}"),
-                fh.P(f"User Input: {entry.get('text', 'No input stored')}"),
-                fh.P(
-                    f"Mood Score: {entry.get('happiness_score', 'Pending Analysis')}/5"
-                ),
-                fh.Details()(
-                    fh.Summary("View Analysis Details"),
-                    fh.Ul(cls="uk-list uk-list-hyphen")(
-                        fh.Li(
-                            f"Social Score: {entry['analysis'].get('socialization', {}).get('score', 'Pending Analysis')}"
-                        ),
-                        fh.Li(
-                            f"Social Explanation: {entry['analysis'].get('socialization', {}).get('explanation', 'N/A')}"
-                        ),
-                        fh.Li(
-                            f"Productivity Score: {entry['analysis'].get('productivity', {}).get('score', 'Pending Analysis')}"
-                        ),
-                        fh.Li(
-                            f"Productivity Explanation: {entry['analysis'].get('productivity', {}).get('explanation', 'N/A')}"
-                        ),
-                        fh.Li(
-                            f"Fulfillment Score: {entry['analysis'].get('fulfillment', {}).get('score', 'Pending Analysis')}"
-                        ),
-                        fh.Li(
-                            f"Fulfillment Explanation: {entry['analysis'].get('fulfillment', {}).get('explanation', 'N/A')}"
-                        ),
-                        fh.Li(
-                            f"Health Score: {entry['analysis'].get('health', {}).get('score', 'Pending Analysis')}"
-                        ),
-                        fh.Li(
-                            f"Health Explanation: {entry['analysis'].get('health', {}).get('explanation', 'N/A')}"
-                        ),
-                    ),
-                ),
-                fh.Details()(
-                    fh.Summary("Suggestions"),
-                    fh.Ul(cls="uk-list uk-list-hyphen")(
-                        *[
-                            fh.Li(f"Social: {suggestion}")
-                            for suggestion in entry["analysis"]
-                            .get("socialization", {})
-                            .get("suggestions", [])
-                        ],
-                        *[
-                            fh.Li(f"Productivity: {suggestion}")
-                            for suggestion in entry["analysis"]
-                            .get("productivity", {})
-                            .get("suggestions", [])
-                        ],
-                        *[
-                            fh.Li(f"Fulfillment: {suggestion}")
-                            for suggestion in entry["analysis"]
-                            .get("fulfillment", {})
-                            .get("suggestions", [])
-                        ],
-                        *[
-                            fh.Li(f"Health: {suggestion}")
-                            for suggestion in entry["analysis"]
-                            .get("health", {})
-                            .get("suggestions", [])
-                        ],
-                    ),
-                ),
-            )
-        )
     return fh.Body(
         fh.Div(cls="intro-screen")(fh.Div(cls="intro-text")("write2me")),
         fh.A("Dashboard", href="/dashboard"),
@@ -137,7 +154,9 @@ def homepage(auth: Auth, session, users_collection: Collection):
                     fh.Div(id="diary-prompt")("Tell me about your day...."),
                 ),
                 fh.Form(hx_post="/submit", hx_target="#data", hx_indicator="#spinner")(
-                    fh.Script(js_css_loader.js["count_keystrokes_for_user_prompts.js"]),
+                    fh.Script(
+                        js_css_loader.load_js()["count_keystrokes_for_user_prompts.js"]
+                    ),
                     fh.Div(
                         fh.Label(
                             "How are you feeling from 1-10?",
@@ -153,9 +172,11 @@ def homepage(auth: Auth, session, users_collection: Collection):
                     fh.Div(style="height: 30px;"),
                     fh.Div(id="diary-prompt")(fh.H2("Tell me about your day....")),
                     fh.Textarea(
-                        diary_entries[0].get("text")
-                        if diary_entries
-                        else "No input stored",
+                        (
+                            diary_entries[0].get("text")
+                            if diary_entries
+                            else "No input stored"
+                        ),
                         name="text",
                         placeholder="What's on your mind?",
                         hx_post="/diary_prompt",
@@ -176,24 +197,33 @@ def homepage(auth: Auth, session, users_collection: Collection):
                 ),
                 fh.Div(id="spinner", data_uk_spinner=True, cls="htmx-indicator"),
                 fh.Div(id="data"),
+                fh.Div(id="history")(fh.H2("History"), *_history_items(diary_entries)),
             ),
             fh.Div(cls="right-sidebar")(
                 *[
-                    fh.A(fh.Span(month), href=f"/{month.lower()}", cls="tab")
-                    for month in [
-                        "January",
-                        "February",
-                        "March",
-                        "April",
-                        "May",
-                        "June",
-                        "July",
-                        "August",
-                        "September",
-                        "October",
-                        "November",
-                        "December",
-                    ]
+                    fh.A(
+                        fh.Span(month),
+                        hx_get=f"/month?month={datetime.now().year}-{number:02d}",
+                        hx_target="#response",
+                        cls="tab",
+                    )
+                    for number, month in enumerate(
+                        [
+                            "January",
+                            "February",
+                            "March",
+                            "April",
+                            "May",
+                            "June",
+                            "July",
+                            "August",
+                            "September",
+                            "October",
+                            "November",
+                            "December",
+                        ],
+                        start=1,
+                    )
                 ],
                 fh.A(fh.Span("Login"), href="#", id="loginTab", cls="tab"),
                 fh.Div(cls="search-container", style="display: flex;")(
@@ -248,62 +278,93 @@ def homepage(auth: Auth, session, users_collection: Collection):
     )
 
 
-def search(
+async def history(
+    before: str, session: dict, entries_collection: AsyncIOMotorCollection
+) -> tuple[fh.FT, ...]:
+    """The history page after the `before` cursor, swapped in for the loader that asked for it."""
+    try:
+        cursor = datetime.fromisoformat(before)
+    except ValueError:
+        # Replaces the loader, so a bad cursor ends the scroll instead of retrying it
+        return (fh.P(f"Invalid history cursor: {before}", style="color: red;"),)
+    user_id = session["user_info"]["id"]
+    entries = await _history_page(entries_collection, user_id, cursor)
+    return tuple(_history_items(entries))
+
+
+async def search(
     search_query: str,
     session: dict,
-    users_collection: Collection,
-    openai_client: OpenAI,
+    entries_collection: AsyncIOMotorCollection,
+    llm: LLMBackend,
 ):
-    search_query_embedding = np.array(
-        openai_client.embeddings.create(
-            input=search_query, model="text-embedding-3-large"
-        )
-        .data[0]
-        .embedding
+    search_query_embedding = await llm.embed_async(
+        search_query, "text-embedding-3-large"
     )
     user_id = session["user_info"]["id"]
-    user: dict = users_collection.find_one({"google_id": user_id})
-    diary_entries: list[dict[str, int | list[dict[str, int]] | Any]] = sorted(
-        user.get("diary_entries"),
-        key=lambda x: np.dot(
-            search_query_embedding,
-            np.array(x.get("vector", [0] * len(search_query_embedding))),
-        )
-        / (
-            norm(search_query_embedding)
-            * norm(x.get("vector", [0] * len(search_query_embedding)))
-        ),
+    matches = await vector_index.search(
+        entries_collection, user_id, search_query_embedding, k=5
     )
 
     return fh.Div(
         *[
-            fh.A(
-                href=f"/diary?date={entry.get('date', datetime.min.strftime('%Y-%m-%d'))}"
-            )(
-                fh.Span(entry.get("text", "")[:100] + "...", style="color: white;"),
+            fh.A(href=f"/diary?date={date}")(
+                fh.Span(preview + "...", style="color: white;"),
                 fh.Br(),
                 fh.Br(),
                 fh.Br(),
             )
-            for entry in diary_entries[:5]
+            for date, preview in matches
+        ]
+    )
+
+
+async def month(
+    month: str, session: dict, entries_collection: AsyncIOMotorCollection
+) -> fh.FT:
+    """Links to the entries written in `month` ("YYYY-MM"), for the month tabs."""
+    try:
+        datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        return fh.P(f"Invalid month: {month}", style="color: red;")
+    user_id = session["user_info"]["id"]
+    entries = await entry_cache.cached(
+        user_id,
+        ("month", month),
+        lambda: entries_repository.month_entries(
+            entries_collection, user_id, month, vector_index.PREVIEW_LENGTH
+        ),
+    )
+    if not entries:
+        return fh.P(f"No diary entries in {month}")
+    return fh.Div(
+        *[
+            fh.A(href=f"/diary?date={entry['date']}")(
+                fh.Span(
+                    f"{entry['date']}: {entry['preview']}...", style="color: white;"
+                ),
+                fh.Br(),
+                fh.Br(),
+            )
+            for entry in entries
         ]
     )
 
 
-def diary(date: datetime, session: dict, users_collection: Collection):
+async def diary(
+    date: datetime, session: dict, entries_collection: AsyncIOMotorCollection
+):
     user_id = session["user_info"]["id"]
-    user: dict = users_collection.find_one({"google_id": user_id})
-    diary_entries: list[dict[str, int | list[dict[str, int]] | Any]] = sorted(
-        user.get("diary_entries"),
-        key=lambda x: int(x.get("date", datetime.min.strftime("%Y-%m-%d")) == date),
-        reverse=True,
+    entry = await entry_cache.cached(
+        user_id,
+        ("diary", date),
+        lambda: entries_repository.entry_by_date(
+            entries_collection, user_id, date, {"_id": 0, "text": 1}
+        ),
     )
-    if (
-        len(diary_entries) > 0
-        and diary_entries[0].get("date", datetime.min.strftime("%Y-%m-%d")) == date
-    ):
+    if entry:
         return fh.Header(fh.A("Main", href="/")), fh.Div(cls="uk-card uk-card-body")(
             fh.H3(cls="uk-card-title")(date),
-            fh.P(diary_entries[0].get("text", "")),
+            fh.P(entry.get("text", "")),
         )
     return fh.P(f"Could not find a diary entry created at {date}")
@@ -0,0 +1,69 @@
+"""Fails when importing the app takes longer than its cold start budget.
+
+Usage: python -m modules.import_budget [--budget-ms 1500] [--runs 3] [--module main]
+
+Imports the module in fresh interpreters under `python -X importtime`, so a server
+process or a respawned worker pays the same cost. Run it from the repository root.
+"""
+
+import argparse
+import subprocess
+import sys
+
+# Only needed once a request uses them, never to start serving
+DEFERRED_MODULES = ["openai"]
+
+
+def _import_times(module: str) -> dict[str, int]:
+    """Cumulative import time in microseconds of every module `module` pulls in."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    times: dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=1500)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--module", default="main")
+    args = parser.parse_args()
+
+    # The fastest run is the least disturbed by whatever else the machine is doing
+    runs = [_import_times(args.module) for _ in range(args.runs)]
+    times = min(runs, key=lambda run: run[args.module])
+    total_ms = times[args.module] / 1000
+
+    for name, cumulative in sorted(times.items(), key=lambda item: -item[1])[:10]:
+        print(f"{cumulative / 1000:8.1f} ms  {name}")
+
+    failed = False
+    imported = [module for module in DEFERRED_MODULES if module in times]
+    if imported:
+        print(f"❌ Imported at startup instead of on first use: {', '.join(imported)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(
+            f"❌ Importing {args.module} took {total_ms:.0f} ms, over {args.budget_ms:.0f} ms"
+        )
+        failed = True
+    if failed:
+        sys.exit(1)
+    print(
+        f"✅ Importing {args.module} took {total_ms:.0f} ms of {args.budget_ms:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import abc
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import time
+import types
+import typing
+from typing import TYPE_CHECKING, AsyncIterator, Generator, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+EMBEDDING_DIMENSIONS = 3072  # text-embedding-3-large
+
+
+class LLMBackend(abc.ABC):
+    """Chat, structured parse and embedding calls used by the app.
+
+    `chat` and `parse` also return the total tokens the call used (0 if unknown),
+    and `chat_stream` returns it when the stream is exhausted.
+
+    The `_async` variants serve the request handlers. By default they run the blocking
+    call in a thread, backends with a native async client override them. A backend that
+    misses one of the blocking calls cannot be created.
+    """
+
+    @abc.abstractmethod
+    def chat(self, model: str, messages: list[dict]) -> tuple[str, int]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def chat_stream(
+        self, model: str, messages: list[dict]
+    ) -> Generator[str, None, int]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def parse(
+        self, model: str, messages: list[dict], response_format: type[BaseModel]
+    ) -> tuple[BaseModel, int]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def embed(self, text: str, model: str) -> list[float]:
+        raise NotImplementedError
+
+    async def chat_async(self, model: str, messages: list[dict]) -> tuple[str, int]:
+        return await asyncio.to_thread(self.chat, model, messages)
+
+    async def chat_stream_async(
+        self, model: str, messages: list[dict], usage: dict[str, int]
+    ) -> AsyncIterator[str]:
+        """Yields content deltas and sets `usage["total_tokens"]` once exhausted."""
+        stream = self.chat_stream(model, messages)
+        try:
+            while True:
+                done, value = await asyncio.to_thread(_next_delta, stream)
+                if done:
+                    usage["total_tokens"] = value
+                    return
+                yield value
+        finally:
+            stream.close()
+
+    async def embed_async(self, text: str, model: str) -> list[float]:
+        return await asyncio.to_thread(self.embed, text, model)
+
+    def warm_up(self) -> None:
+        """Creates any clients ahead of the first call, off the startup path."""
+
+
+def _next_delta(stream: Generator[str, None, int]) -> tuple[bool, str | int]:
+    # StopIteration cannot cross the thread boundary, so the end is returned as a flag
+    try:
+        return False, next(stream)
+    except StopIteration as finished:
+        return True, finished.value or 0
+
+
+class OpenAIBackend(LLMBackend):
+    def __init__(self, api_key: Optional[str]):
+        self.api_key = api_key
+
+    # The openai package takes most of the app's import time, so it is only imported
+    # once a client is needed
+    @functools.cached_property
+    def client(self) -> "OpenAI":
+        from openai import OpenAI
+
+        return OpenAI(api_key=self.api_key)
+
+    @functools.cached_property
+    def async_client(self) -> "AsyncOpenAI":
+        from openai import AsyncOpenAI
+
+        return AsyncOpenAI(api_key=self.api_key)
+
+    def warm_up(self) -> None:
+        self.client
+        self.async_client
+
+    def chat(self, model: str, messages: list[dict]) -> tuple[str, int]:
+        response = self.client.chat.completions.create(model=model, messages=messages)
+        return (
+            response.choices[0].message.content,
+            response.usage.total_tokens if response.usage else 0,
+        )
+
+    def chat_stream(
+        self, model: str, messages: list[dict]
+    ) -> Generator[str, None, int]:
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        tokens = 0
+        try:
+            for chunk in stream:
+                if chunk.usage:
+                    tokens = chunk.usage.total_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Stops generation upstream when the consumer went away mid stream
+            stream.close()
+        return tokens
+
+    def parse(
+        self, model: str, messages: list[dict], response_format: type[BaseModel]
+    ) -> tuple[BaseModel, int]:
+        response = self.client.beta.chat.completions.parse(
+            model=model, messages=messages, response_format=response_format
+        )
+        return (
+            response.choices[0].message.parsed,
+            response.usage.total_tokens if response.usage else 0,
+        )
+
+    def embed(self, text: str, model: str) -> list[float]:
+        return self.client.embeddings.create(input=text, model=model).data[0].embedding
+
+    async def chat_async(self, model: str, messages: list[dict]) -> tuple[str, int]:
+        response = await self.async_client.chat.completions.create(
+            model=model, messages=messages
+        )
+        return (
+            response.choices[0].message.content,
+            response.usage.total_tokens if response.usage else 0,
+        )
+
+    async def chat_stream_async(
+        self, model: str, messages: list[dict], usage: dict[str, int]
+    ) -> AsyncIterator[str]:
+        stream = await self.async_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    usage["total_tokens"] = chunk.usage.total_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+
+    async def embed_async(self, text: str, model: str) -> list[float]:
+        response = await self.async_client.embeddings.create(input=text, model=model)
+        return response.data[0].embedding
+
+
+class StubBackend(LLMBackend):
+    """Deterministic offline backend for load testing without network or spend.
+
+    Every response is derived from a hash of the request, and each call sleeps for
+    `latency_seconds` to stand in for the API round trip.
+    """
+
+    def __init__(
+        self,
+        latency_seconds: float = 0.0,
+        token_latency_seconds: float = 0.0,
+        dimensions: int = EMBEDDING_DIMENSIONS,
+    ):
+        self.latency_seconds = latency_seconds
+        self.token_latency_seconds = token_latency_seconds
+        self.dimensions = dimensions
+
+    @staticmethod
+    def _seed(*parts) -> int:
+        digest = hashlib.sha256(json.dumps(parts, default=str).encode("utf-8"))
+        return int.from_bytes(digest.digest()[:8], "big")
+
+    def _content(self, model: str, messages: list[dict]) -> str:
+        seed = self._seed(model, messages)
+        return f"Stub response {seed % 1000}: what else made today stand out to you?"
+
+    def _build(self, response_format: type[BaseModel], seed: int) -> BaseModel:
+        values = {}
+        for i, (name, field) in enumerate(response_format.model_fields.items()):
+            annotation = field.annotation
+            if typing.get_origin(annotation) in (typing.Union, types.UnionType):
+                # Optional[X] -> X
+                annotation = next(
+                    arg for arg in typing.get_args(annotation) if arg is not type(None)
+                )
+            if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+                values[name] = self._build(annotation, self._seed(seed, name))
+            elif annotation is int:
+                values[name] = 1 + (seed + i) % 10
+            elif typing.get_origin(annotation) is list:
+                values[name] = [f"Stub {name} {n}" for n in range(1 + (seed + i) % 3)]
+            else:
+                values[name] = f"Stub {name} {seed % 1000}"
+        return response_format.model_validate(values)
+
+    def chat(self, model: str, messages: list[dict]) -> tuple[str, int]:
+        time.sleep(self.latency_seconds)
+        content = self._content(model, messages)
+        return content, len(content.split())
+
+    def chat_stream(
+        self, model: str, messages: list[dict]
+    ) -> Generator[str, None, int]:
+        time.sleep(self.latency_seconds)
+        words = self._content(model, messages).split(" ")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.token_latency_seconds)
+            yield word if i == 0 else f" {word}"
+        return len(words)
+
+    def parse(
+        self, model: str, messages: list[dict], response_format: type[BaseModel]
+    ) -> tuple[BaseModel, int]:
+        time.sleep(self.latency_seconds)
+        seed = self._seed(model, messages, response_format.__name__)
+        return self._build(response_format, seed), 0
+
+    def embed(self, text: str, model: str) -> list[float]:
+        time.sleep(self.latency_seconds)
+        return self._vector(text, model)
+
+    def _vector(self, text: str, model: str) -> list[float]:
+        rng = np.random.default_rng(self._seed(model, text))
+        vector = rng.standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    async def chat_async(self, model: str, messages: list[dict]) -> tuple[str, int]:
+        await asyncio.sleep(self.latency_seconds)
+        content = self._content(model, messages)
+        return content, len(content.split())
+
+    async def chat_stream_async(
+        self, model: str, messages: list[dict], usage: dict[str, int]
+    ) -> AsyncIterator[str]:
+        await asyncio.sleep(self.latency_seconds)
+        words = self._content(model, messages).split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_latency_seconds)
+            yield word if i == 0 else f" {word}"
+        usage["total_tokens"] = len(words)
+
+    async def embed_async(self, text: str, model: str) -> list[float]:
+        await asyncio.sleep(self.latency_seconds)
+        return self._vector(text, model)
+
+
+def create_backend() -> LLMBackend:
+    """Builds the backend selected by `LLM_BACKEND` ("openai" or "stub")."""
+    if os.getenv("LLM_BACKEND", "openai") == "stub":
+        print("⚠️ Using the offline stub LLM backend")
+        return StubBackend(
+            latency_seconds=float(os.getenv("STUB_LATENCY_MS", "0")) / 1000,
+            token_latency_seconds=float(os.getenv("STUB_TOKEN_LATENCY_MS", "0")) / 1000,
+        )
+    return OpenAIBackend(api_key=os.getenv("OPENAI_API_KEY"))
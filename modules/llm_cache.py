@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pydantic import BaseModel
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from modules.llm_backend import LLMBackend
+
+LRU_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+
+# key -> (expires_at timestamp, cached value, seconds the original call took, tokens it used)
+_lru: OrderedDict[str, tuple[float, Any, float, int]] = OrderedDict()
+_lru_lock = threading.Lock()
+_persistent_collection: Optional[Collection] = None
+# Same collection through Motor, for lookups from the async request handlers
+_async_persistent_collection: Optional[AsyncIOMotorCollection] = None
+# Set by `init_persistent_cache` until the TTL index exists
+_pending_collections: Optional[tuple[Collection, AsyncIOMotorCollection]] = None
+
+stats: dict[str, float] = {
+    "memory_hits": 0,
+    "persistent_hits": 0,
+    "misses": 0,
+    "saved_seconds": 0.0,
+    "saved_tokens": 0,
+}
+
+
+def init_persistent_cache(db: Database, async_db: AsyncIOMotorDatabase) -> None:
+    """Enables the Mongo backed tier when `LLM_CACHE_PERSIST` is set.
+
+    Documents expire through a TTL index on `expires_at`, so Mongo evicts them on its own.
+    The tier is only used once `create_indexes` has created that index.
+    """
+    global _pending_collections
+    if os.getenv("LLM_CACHE_PERSIST", "").lower() not in ("1", "true", "yes"):
+        return
+    _pending_collections = (db["llm_cache"], async_db["llm_cache"])
+
+
+def create_indexes() -> None:
+    global _persistent_collection, _async_persistent_collection
+    if not _pending_collections:
+        return
+    collection, async_collection = _pending_collections
+    try:
+        collection.create_index("expires_at", expireAfterSeconds=0)
+        _persistent_collection = collection
+        _async_persistent_collection = async_collection
+        print("✅ Persistent LLM cache enabled")
+    except Exception as e:
+        print(f"❌ Persistent LLM cache disabled: {e}")
+
+
+def cache_key(
+    model: str,
+    system_prompt: str,
+    user_message: str,
+    response_format: Optional[type[BaseModel]] = None,
+) -> str:
+    def _sha(value: str) -> str:
+        return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+    schema = (
+        json.dumps(response_format.model_json_schema(), sort_keys=True)
+        if response_format
+        else ""
+    )
+    return _sha(
+        json.dumps([model, _sha(system_prompt), _sha(user_message), _sha(schema)])
+    )
+
+
+def get_stats() -> dict[str, float]:
+    hits = stats["memory_hits"] + stats["persistent_hits"]
+    lookups = hits + stats["misses"]
+    return {
+        **stats,
+        "hit_rate": hits / lookups if lookups else 0.0,
+        "memory_entries": len(_lru),
+    }
+
+
+def _remember(key: str, value: Any, seconds: float, tokens: int) -> None:
+    with _lru_lock:
+        _lru[key] = (time.time() + TTL_SECONDS, value, seconds, tokens)
+        _lru.move_to_end(key)
+        while len(_lru) > LRU_SIZE:
+            _lru.popitem(last=False)
+
+
+def _lookup_memory(key: str) -> Optional[Any]:
+    with _lru_lock:
+        cached = _lru.get(key)
+        if cached and cached[0] > time.time():
+            _lru.move_to_end(key)
+            stats["memory_hits"] += 1
+            stats["saved_seconds"] += cached[2]
+            stats["saved_tokens"] += cached[3]
+            return cached[1]
+        if cached:
+            del _lru[key]
+    return None
+
+
+def _persistent_hit(key: str, document: Optional[dict]) -> Optional[Any]:
+    if not document:
+        return None
+    _remember(key, document["value"], document["seconds"], document["tokens"])
+    with _lru_lock:
+        stats["persistent_hits"] += 1
+        stats["saved_seconds"] += document["seconds"]
+        stats["saved_tokens"] += document["tokens"]
+    return document["value"]
+
+
+def _persistent_document(value: Any, seconds: float, tokens: int) -> dict:
+    return {
+        "value": value,
+        "seconds": seconds,
+        "tokens": tokens,
+        "expires_at": datetime.now() + timedelta(seconds=TTL_SECONDS),
+    }
+
+
+def _lookup(key: str) -> Optional[Any]:
+    cached = _lookup_memory(key)
+    if cached is not None or _persistent_collection is None:
+        return cached
+    try:
+        document = _persistent_collection.find_one(
+            {"_id": key, "expires_at": {"$gt": datetime.now()}}
+        )
+    except Exception as e:
+        print(f"⚠️ Persistent LLM cache lookup failed: {e}")
+        return None
+    return _persistent_hit(key, document)
+
+
+async def _lookup_async(key: str) -> Optional[Any]:
+    cached = _lookup_memory(key)
+    if cached is not None or _async_persistent_collection is None:
+        return cached
+    try:
+        document = await _async_persistent_collection.find_one(
+            {"_id": key, "expires_at": {"$gt": datetime.now()}}
+        )
+    except Exception as e:
+        print(f"⚠️ Persistent LLM cache lookup failed: {e}")
+        return None
+    return _persistent_hit(key, document)
+
+
+def _store(key: str, value: Any, seconds: float, tokens: int) -> None:
+    with _lru_lock:
+        stats["misses"] += 1
+    _remember(key, value, seconds, tokens)
+    if _persistent_collection is None:
+        return
+    try:
+        _persistent_collection.replace_one(
+            {"_id": key},
+            _persistent_document(value, seconds, tokens),
+            upsert=True,
+        )
+    except Exception as e:
+        print(f"⚠️ Persistent LLM cache write failed: {e}")
+
+
+async def _store_async(key: str, value: Any, seconds: float, tokens: int) -> None:
+    with _lru_lock:
+        stats["misses"] += 1
+    _remember(key, value, seconds, tokens)
+    if _async_persistent_collection is None:
+        return
+    try:
+        await _async_persistent_collection.replace_one(
+            {"_id": key},
+            _persistent_document(value, seconds, tokens),
+            upsert=True,
+        )
+    except Exception as e:
+        print(f"⚠️ Persistent LLM cache write failed: {e}")
+
+
+def _messages(system_prompt: str, user_message: str) -> list[dict[str, str]]:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message},
+    ]
+
+
+async def chat(
+    llm: LLMBackend, model: str, system_prompt: str, user_message: str
+) -> str:
+    """Cached chat completion, returning the message content."""
+    key = cache_key(model, system_prompt, user_message)
+    cached = await _lookup_async(key)
+    if cached is not None:
+        return cached
+
+    start = time.perf_counter()
+    content, tokens = await llm.chat_async(
+        model, _messages(system_prompt, user_message)
+    )
+    await _store_async(key, content, time.perf_counter() - start, tokens)
+    return content
+
+
+def chat_sync(
+    llm: LLMBackend, model: str, system_prompt: str, user_message: str
+) -> str:
+    """`chat` for the analysis worker threads."""
+    key = cache_key(model, system_prompt, user_message)
+    cached = _lookup(key)
+    if cached is not None:
+        return cached
+
+    start = time.perf_counter()
+    content, tokens = llm.chat(model, _messages(system_prompt, user_message))
+    _store(key, content, time.perf_counter() - start, tokens)
+    return content
+
+
+async def chat_stream(
+    llm: LLMBackend, model: str, system_prompt: str, user_message: str
+) -> AsyncIterator[str]:
+    """Cached streaming chat completion, yielding content deltas.
+
+    A cache hit yields the whole completion at once. The completion is only cached
+    when the stream was read to the end.
+    """
+    key = cache_key(model, system_prompt, user_message)
+    cached = await _lookup_async(key)
+    if cached is not None:
+        yield cached
+        return
+
+    start = time.perf_counter()
+    usage = {"total_tokens": 0}
+    stream = llm.chat_stream_async(model, _messages(system_prompt, user_message), usage)
+    content: list[str] = []
+    try:
+        async for delta in stream:
+            content.append(delta)
+            yield delta
+    finally:
+        await stream.aclose()
+    await _store_async(
+        key, "".join(content), time.perf_counter() - start, usage["total_tokens"]
+    )
+
+
+def parse(
+    llm: LLMBackend,
+    model: str,
+    system_prompt: str,
+    user_message: str,
+    response_format: type[BaseModel],
+) -> BaseModel:
+    """Cached structured output completion, returning the parsed `response_format`."""
+    key = cache_key(model, system_prompt, user_message, response_format)
+    cached = _lookup(key)
+    if cached is not None:
+        return response_format.model_validate(cached)
+
+    start = time.perf_counter()
+    parsed, tokens = llm.parse(
+        model, _messages(system_prompt, user_message), response_format
+    )
+    _store(key, parsed.model_dump(), time.perf_counter() - start, tokens)
+    return parsed
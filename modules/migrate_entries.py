@@ -0,0 +1,106 @@
+"""Moves diary entries embedded in `users.diary_entries` into the `diary_entries` collection.
+
+Usage: python -m modules.migrate_entries [--batch-size 200] [--keep-embedded]
+
+Safe to rerun: entries that already exist in the collection for a (google_id, date) are
+left as they are, so entries written since the switch are never overwritten.
+"""
+
+import argparse
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+
+from modules.db import connect_db
+
+
+def _migrate_user(
+    users_collection: Collection,
+    entries_collection: Collection,
+    user: dict,
+    batch_size: int,
+    keep_embedded: bool,
+) -> int:
+    migrated = 0
+    for skip in range(0, user["entry_count"], batch_size):
+        # Page through the embedded array so a large user document is never loaded at once
+        page = users_collection.find_one(
+            {"_id": user["_id"]},
+            {"diary_entries": {"$slice": [skip, batch_size]}, "google_id": 1},
+        )
+        operations = []
+        for entry in page.get("diary_entries", []):
+            date = entry.get("date") or entry["created_at"].strftime("%Y-%m-%d")
+            operations.append(
+                UpdateOne(
+                    {"google_id": user["google_id"], "date": date},
+                    {
+                        "$setOnInsert": {
+                            **entry,
+                            "google_id": user["google_id"],
+                            "date": date,
+                            "text_length": len(entry.get("text", "")),
+                        }
+                    },
+                    upsert=True,
+                )
+            )
+        if operations:
+            result = entries_collection.bulk_write(operations, ordered=False)
+            migrated += result.upserted_count
+
+    if not keep_embedded:
+        users_collection.update_one(
+            {"_id": user["_id"]}, {"$unset": {"diary_entries": ""}}
+        )
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument(
+        "--keep-embedded",
+        action="store_true",
+        help="Do not remove the embedded arrays after copying them",
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    _, users_collection, entries_collection = connect_db()
+    users = users_collection.aggregate(
+        [
+            {"$match": {"diary_entries.0": {"$exists": True}}},
+            {
+                "$project": {
+                    "google_id": 1,
+                    "entry_count": {"$size": "$diary_entries"},
+                }
+            },
+        ]
+    )
+    user_count = 0
+    entry_count = 0
+    for user in users:
+        try:
+            migrated = _migrate_user(
+                users_collection,
+                entries_collection,
+                user,
+                args.batch_size,
+                args.keep_embedded,
+            )
+        except Exception as e:
+            print(f"❌ Migration failed for user {user['google_id']}: {e}")
+            continue
+        user_count += 1
+        entry_count += migrated
+        print(
+            f"✅ Migrated {migrated}/{user['entry_count']} entries for {user['google_id']}"
+        )
+    print(f"✅ Migrated {entry_count} entries for {user_count} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+import modules.text_fingerprint as text_fingerprint
+
+MIN_CHANGED_CHARS = int(os.getenv("PROMPT_MIN_CHANGED_CHARS", "20"))
+MAX_SESSIONS = 10000
+
+# session key -> last draft that was prompted for
+_sessions: OrderedDict[str, str] = OrderedDict()
+_lock = threading.Lock()
+
+
+def session_key(session: dict) -> str:
+    if "prompt_session" not in session:
+        session["prompt_session"] = uuid.uuid4().hex
+    return session["prompt_session"]
+
+
+def _barely_changed(previous: str, current: str) -> bool:
+    # A length change this large is a real change, no need to diff
+    if abs(len(current) - len(previous)) >= MIN_CHANGED_CHARS:
+        return False
+    return text_fingerprint.changed_chars(previous, current) < MIN_CHANGED_CHARS
+
+
+def submit(key: str, text: str) -> bool:
+    """Registers a new draft for the session.
+
+    Returns:
+        bool: Whether to prompt for it, False when it barely differs from the last
+        draft that was prompted for
+    """
+    with _lock:
+        last_prompted = _sessions.get(key)
+    # Diffed outside the lock, which every draft posted by every session goes through
+    if last_prompted is not None and _barely_changed(last_prompted, text):
+        return False
+    with _lock:
+        _sessions[key] = text
+        _sessions.move_to_end(key)
+        while len(_sessions) > MAX_SESSIONS:
+            _sessions.popitem(last=False)
+    return True
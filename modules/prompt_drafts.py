@@ -0,0 +1,128 @@
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncGenerator, Awaitable, Optional, TypeVar
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+T = TypeVar("T")
+
+TTL_SECONDS = 60
+# How often a running stream checks whether a newer draft replaced its own
+CHECK_SECONDS = float(os.getenv("PROMPT_DRAFT_CHECK_SECONDS", "1"))
+
+
+def init_drafts_collection(db: Database) -> Collection:
+    # One document per prompt session holding its latest draft, so any server process
+    # can stream the prompt for it
+    return db["prompt_drafts"]
+
+
+def create_indexes(drafts_collection: Collection) -> None:
+    drafts_collection.create_index("expires_at", expireAfterSeconds=0)
+    print("✅ Prompt draft indexes created")
+
+
+async def save(
+    drafts_collection: AsyncIOMotorCollection, session_key: str, text: str
+) -> str:
+    """Stores the session's latest draft, superseding the previous one.
+
+    Returns:
+        str: Id of the draft, which its EventSource passes back to stream it
+    """
+    draft_id = uuid.uuid4().hex
+    await drafts_collection.replace_one(
+        {"_id": session_key},
+        {
+            "draft_id": draft_id,
+            "text": text,
+            "streamed": False,
+            "expires_at": datetime.now() + timedelta(seconds=TTL_SECONDS),
+        },
+        upsert=True,
+    )
+    return draft_id
+
+
+async def take(
+    drafts_collection: AsyncIOMotorCollection, session_key: str, draft_id: str
+) -> Optional[str]:
+    """The text of the draft if it is still the latest and was not streamed yet."""
+    draft = await drafts_collection.find_one_and_update(
+        {
+            "_id": session_key,
+            "draft_id": draft_id,
+            "streamed": False,
+            "expires_at": {"$gt": datetime.now()},
+        },
+        {"$set": {"streamed": True}},
+        projection={"text": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    return draft["text"] if draft else None
+
+
+async def _replaced(
+    drafts_collection: AsyncIOMotorCollection, session_key: str, draft_id: str
+) -> bool:
+    # An expired draft is not a newer one, only a replaced draft stops it
+    return bool(
+        await drafts_collection.find_one(
+            {"_id": session_key, "draft_id": {"$ne": draft_id}}, {"_id": 1}
+        )
+    )
+
+
+async def while_latest(
+    drafts_collection: AsyncIOMotorCollection,
+    session_key: str,
+    draft_id: str,
+    tokens: AsyncGenerator[str, None],
+) -> AsyncGenerator[str, None]:
+    """Passes `tokens` through until a newer draft of the session replaces this one.
+
+    Checked against the database at most every `CHECK_SECONDS`, as the newer draft may
+    have been posted to another process. Stopping early closes `tokens`, which cancels
+    the upstream completion.
+    """
+    checked_at = time.monotonic()
+    try:
+        async for token in tokens:
+            if time.monotonic() - checked_at >= CHECK_SECONDS:
+                checked_at = time.monotonic()
+                if await _replaced(drafts_collection, session_key, draft_id):
+                    print("⚠️ Dropped superseded prompt draft")
+                    return
+            yield token
+    finally:
+        await tokens.aclose()
+
+
+async def call_while_latest(
+    drafts_collection: AsyncIOMotorCollection,
+    session_key: str,
+    draft_id: str,
+    call: Awaitable[T],
+) -> Optional[T]:
+    """Awaits `call`, cancelling it once a newer draft of the session replaces this one.
+
+    Returns:
+        Optional[T]: Result of `call`, or None when the draft was replaced before it ended
+    """
+    task = asyncio.ensure_future(call)
+    try:
+        while True:
+            done, _ = await asyncio.wait([task], timeout=CHECK_SECONDS)
+            if await _replaced(drafts_collection, session_key, draft_id):
+                print("⚠️ Dropped superseded prompt draft")
+                return None
+            if done:
+                return task.result()
+    finally:
+        task.cancel()
@@ -0,0 +1,266 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import DuplicateKeyError
+
+import modules.entries_repository as entries_repository
+import modules.feature_model as feature_model
+
+# Reads of the entries before giving up on storing a rebuilt rollup
+REBUILD_ATTEMPTS = 3
+
+
+def init_rollups_collection(db: Database) -> Collection:
+    # One document per user, keyed by `google_id`, so it needs no extra indexes
+    return db["score_rollups"]
+
+
+def _periods(date: str) -> tuple[str, str, list[str], list[str]]:
+    """ISO week and month keys of `date`, and every date in that week and month."""
+    day = datetime.strptime(date, "%Y-%m-%d").date()
+    year, week, _ = day.isocalendar()
+    week_start = day - timedelta(days=day.weekday())
+    week_dates = [(week_start + timedelta(days=i)).isoformat() for i in range(7)]
+    month_dates = []
+    current = day.replace(day=1)
+    while current.month == day.month:
+        month_dates.append(current.isoformat())
+        current += timedelta(days=1)
+    return f"{year}-W{week:02d}", day.strftime("%Y-%m"), week_dates, month_dates
+
+
+def _summary_expression(dates: list[str], metric: str) -> dict:
+    # Days without an entry evaluate to null inside the array literal and are dropped
+    values = {
+        "$filter": {
+            "input": [f"$days.{date}.{metric}" for date in dates],
+            "cond": {"$ne": ["$$this", None]},
+        }
+    }
+    return {
+        "$let": {
+            "vars": {"values": values},
+            "in": {
+                "mean": {"$avg": "$$values"},
+                "count": {"$size": "$$values"},
+                "min": {"$min": "$$values"},
+                "max": {"$max": "$$values"},
+            },
+        }
+    }
+
+
+def _summary(values: list[int]) -> dict:
+    return {
+        "mean": sum(values) / len(values),
+        "count": len(values),
+        "min": min(values),
+        "max": max(values),
+    }
+
+
+def _record_pipeline(date: str, scores: dict[str, int]) -> list[dict]:
+    week, month, week_dates, month_dates = _periods(date)
+    return [
+        {
+            "$set": {
+                f"days.{date}.{metric}": {"$literal": score}
+                for metric, score in scores.items()
+            }
+        },
+        {
+            "$set": {
+                **{
+                    f"weeks.{week}.{metric}": _summary_expression(week_dates, metric)
+                    for metric in scores
+                },
+                **{
+                    f"months.{month}.{metric}": _summary_expression(month_dates, metric)
+                    for metric in scores
+                },
+            }
+        },
+    ]
+
+
+def _record_projection(date: str) -> dict:
+    return {
+        f"days.{date}": 1,
+        "feature_model.half_life_days": 1,
+        "feature_model.epoch": 1,
+    }
+
+
+def _model_update(
+    before: Optional[dict], date: str, scores: dict[str, int]
+) -> Optional[tuple[dict, dict]]:
+    """Filter and update that move the feature model from the day's old scores to its new ones.
+
+    `before` is the rollup as the record update found it, so concurrent records of the
+    same day each apply the change from the scores they replaced.
+    """
+    if not before or not feature_model.is_current(before.get("feature_model")):
+        # Accumulated from the days in full by `get_rollup`
+        return None
+    model = before["feature_model"]
+    current = {
+        "_id": before["_id"],
+        "feature_model.half_life_days": feature_model.HALF_LIFE_DAYS,
+        "feature_model.epoch": model["epoch"],
+    }
+    if not feature_model.fits(model, date):
+        # Weights from this epoch would overflow, `get_rollup` rebuilds it from the days
+        return current, {"$unset": {"feature_model": ""}}
+    previous = before.get("days", {}).get(date, {})
+    increments = feature_model.increments(
+        date, previous, {**previous, **scores}, model["epoch"]
+    )
+    if not increments:
+        return None
+    return (
+        current,
+        {
+            "$inc": {
+                f"feature_model.{path}": value for path, value in increments.items()
+            }
+        },
+    )
+
+
+def record(
+    rollups_collection: Collection, google_id: str, date: str, scores: dict[str, int]
+) -> None:
+    """Sets the scores of the entry for `date` and refreshes its week and month in one write.
+
+    A day has a single entry, so its bucket holds the scores themselves. The week and month
+    summaries are recomputed from their days inside the update, which keeps them exact
+    when an entry is resubmitted with different scores. The feature model is then moved
+    from the day's previous scores to the new ones.
+
+    Args:
+        scores (dict[str, int]): `happiness` and/or category scores that changed
+    """
+    if scores:
+        before = rollups_collection.find_one_and_update(
+            {"_id": google_id},
+            _record_pipeline(date, scores),
+            projection=_record_projection(date),
+            upsert=True,
+        )
+        model_update = _model_update(before, date, scores)
+        if model_update:
+            rollups_collection.update_one(*model_update)
+
+
+async def record_async(
+    rollups_collection: AsyncIOMotorCollection,
+    google_id: str,
+    date: str,
+    scores: dict[str, int],
+) -> None:
+    """`record` for the async request handlers."""
+    if scores:
+        before = await rollups_collection.find_one_and_update(
+            {"_id": google_id},
+            _record_pipeline(date, scores),
+            projection=_record_projection(date),
+            upsert=True,
+        )
+        model_update = _model_update(before, date, scores)
+        if model_update:
+            await rollups_collection.update_one(*model_update)
+
+
+async def _rollup_from_entries(
+    entries_collection: AsyncIOMotorCollection, google_id: str
+) -> dict:
+    days: dict[str, dict[str, int]] = {}
+    for entry in await entries_repository.score_series(entries_collection, google_id):
+        scores = {
+            metric: score
+            for metric, score in entry.get("scores", {}).items()
+            if score is not None
+        }
+        if entry.get("happiness_score") is not None:
+            scores["happiness"] = entry["happiness_score"]
+        days[entry["date"]] = scores
+
+    grouped: dict[str, dict[str, dict[str, list[int]]]] = {"weeks": {}, "months": {}}
+    for date, scores in days.items():
+        week, month, _, _ = _periods(date)
+        for period, key in (("weeks", week), ("months", month)):
+            for metric, score in scores.items():
+                grouped[period].setdefault(key, {}).setdefault(metric, []).append(score)
+
+    rollup = {
+        "days": days,
+        **{
+            period: {
+                key: {metric: _summary(values) for metric, values in metrics.items()}
+                for key, metrics in keys.items()
+            }
+            for period, keys in grouped.items()
+        },
+        "feature_model": feature_model.build(days),
+        "complete": True,
+    }
+    return rollup
+
+
+async def rebuild(
+    rollups_collection: AsyncIOMotorCollection,
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+) -> dict:
+    """Recomputes the user's rollup from their entries, for histories written before rollups.
+
+    It is only stored if no day was recorded while the entries were read, otherwise the
+    entries are read again, up to `REBUILD_ATTEMPTS` times.
+    """
+    for _ in range(REBUILD_ATTEMPTS):
+        # Entries are written before their day is recorded, so any record made after
+        # this read changes `days` and fails the store below
+        current = await rollups_collection.find_one({"_id": google_id}, {"days": 1})
+        rollup = await _rollup_from_entries(entries_collection, google_id)
+        try:
+            result = await rollups_collection.update_one(
+                {
+                    "_id": google_id,
+                    "days": current.get("days") if current else {"$exists": False},
+                },
+                # Other fields of the rollup, like the exemplar index, are kept
+                {"$set": rollup},
+                upsert=not current,
+            )
+        except DuplicateKeyError:
+            # The first record of the user created the rollup meanwhile
+            continue
+        if result.matched_count or result.upserted_id is not None:
+            print(f"✅ Rebuilt score rollup for user {google_id}")
+            return rollup
+    # Served as read, and rebuilt again by the next request as it is not complete
+    print(f"⚠️ Score rollup for user {google_id} kept changing, not stored")
+    return rollup
+
+
+async def get_rollup(
+    rollups_collection: AsyncIOMotorCollection,
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+) -> dict:
+    """The user's rollup, built from their entries the first time it is needed."""
+    rollup: Optional[dict] = await rollups_collection.find_one({"_id": google_id})
+    if not rollup or not rollup.get("complete"):
+        return await rebuild(rollups_collection, entries_collection, google_id)
+    if not feature_model.is_current(rollup.get("feature_model")):
+        # Rollups from before the model, or accumulated with another decay
+        rollup["feature_model"] = feature_model.build(rollup["days"])
+        # Only stored if no day was recorded since the read, which would be missing from it
+        await rollups_collection.update_one(
+            {"_id": google_id, "days": rollup["days"]},
+            {"$set": {"feature_model": rollup["feature_model"]}},
+        )
+    return rollup
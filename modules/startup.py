@@ -0,0 +1,45 @@
+import os
+import threading
+import time
+from typing import Callable
+
+RETRY_SECONDS = float(os.getenv("STARTUP_RETRY_SECONDS", "5"))
+
+_ready = threading.Event()
+# step name -> "pending", "done" or the error of its last attempt
+_steps: dict[str, str] = {}
+
+
+def run_in_background(steps: list[tuple[str, Callable[[], None]]]) -> None:
+    """Runs the startup `steps` in order on a daemon thread, retrying each until it succeeds.
+
+    The server starts listening straight away and answers `/healthz` meanwhile, `/readyz`
+    only reports ready once every step is done. Steps must be safe to repeat.
+    """
+    _ready.clear()
+    _steps.clear()
+    _steps.update({name: "pending" for name, _ in steps})
+
+    def run():
+        for name, step in steps:
+            while True:
+                try:
+                    step()
+                    break
+                except Exception as e:
+                    _steps[name] = f"{type(e).__name__}: {e}"
+                    print(f"❌ Startup step {name} failed, retrying: {e}")
+                    time.sleep(RETRY_SECONDS)
+            _steps[name] = "done"
+        _ready.set()
+        print("✅ Startup complete")
+
+    threading.Thread(target=run, name="startup", daemon=True).start()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def get_status() -> dict[str, str]:
+    return dict(_steps)
@@ -0,0 +1,47 @@
+from typing import AsyncIterator
+
+import fasthtml.common as fh
+
+# htmx sse extension: https://htmx.org/extensions/sse/
+SSE_EXTENSION_SRC = "https://unpkg.com/htmx-ext-sse@2.2.1/sse.js"
+
+
+def sse_target(url: str, element=fh.P, **kwargs) -> fh.FT:
+    """An element that connects to `url` and appends each streamed message to itself."""
+    return element(
+        hx_ext="sse",
+        sse_connect=url,
+        sse_swap="message",
+        sse_close="close",
+        hx_swap="beforeend",
+        **kwargs,
+    )
+
+
+async def sse_tokens(tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Wraps completion deltas as SSE messages, ending with the `close` event.
+
+    The close event stops the browser's EventSource from reconnecting and
+    generating the completion again.
+    """
+    try:
+        async for token in tokens:
+            yield fh.sse_message(fh.Span(token))
+    except Exception as e:
+        print(f"🔥 Streaming completion failed: {e}")
+    yield _close_message()
+
+
+async def sse_text(text: str) -> AsyncIterator[str]:
+    """A stream of `text` as a single message, ending with the `close` event."""
+    yield fh.sse_message(fh.Span(text))
+    yield _close_message()
+
+
+async def sse_close() -> AsyncIterator[str]:
+    """A stream with only the `close` event, for when there is nothing (left) to send."""
+    yield _close_message()
+
+
+def _close_message() -> str:
+    return fh.sse_message(fh.Span(), event="close")
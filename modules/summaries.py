@@ -0,0 +1,312 @@
+import asyncio
+import json
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+import modules.entries_repository as entries_repository
+import modules.entry_cache as entry_cache
+import modules.llm_cache as llm_cache
+import modules.text_fingerprint as text_fingerprint
+import prompts_and_schemas.diary_prompt as diary_prompt
+from modules.llm_backend import LLMBackend
+
+MODEL = "gpt-4o-mini"
+# Stands in for the digest of entries that have not been analyzed yet
+PREVIEW_LENGTH = 300
+
+stats: dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    # Waited on a completion another request of this process was already generating
+    "shared": 0,
+}
+# Summaries being generated in this process, so concurrent requests for one, like the
+# weekly and the monthly stream of a dashboard, share a single completion
+_in_flight: dict[str, asyncio.Future] = {}
+
+
+def init_summaries_collection(db: Database) -> Collection:
+    # One document per user and period, keyed by `{google_id}:{period key}`
+    return db["summaries"]
+
+
+def week_key(day: date) -> str:
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _week_dates(week: str) -> tuple[str, str]:
+    monday = datetime.strptime(f"{week}-1", "%G-W%V-%u").date()
+    return monday.isoformat(), (monday + timedelta(days=6)).isoformat()
+
+
+def _month_weeks(month: str) -> list[str]:
+    """The ISO weeks with at least one day in `month` ("YYYY-MM")."""
+    current = datetime.strptime(month, "%Y-%m").date()
+    weeks: list[str] = []
+    while current.strftime("%Y-%m") == month:
+        if week_key(current) not in weeks:
+            weeks.append(week_key(current))
+        current += timedelta(days=1)
+    return weeks
+
+
+def _source_hash(system_prompt: str, message: str) -> str:
+    return text_fingerprint.content_hash(json.dumps([MODEL, system_prompt, message]))
+
+
+async def _week_message(
+    entries_collection: AsyncIOMotorCollection, google_id: str, week: str
+) -> Optional[str]:
+    first_date, last_date = _week_dates(week)
+    digests = await entry_cache.cached(
+        google_id,
+        ("period_digests", first_date, last_date),
+        lambda: entries_repository.period_digests(
+            entries_collection, google_id, first_date, last_date, PREVIEW_LENGTH
+        ),
+    )
+    if not digests:
+        return None
+    prompt = "<entries>\n"
+    for entry in digests:
+        prompt += f"""
+    <entry>
+        <date>{entry["date"]}</date>
+        <happiness_score>{entry.get("happiness_score", 0)}</happiness_score>
+        <digest>{entry["digest"]}</digest>
+    </entry>"""
+    prompt += "\n</entries>"
+    return f"""These are digests of my diary entries from the week {week}. Give me a goal to pursue\n{prompt}"""
+
+
+async def _month_message(
+    llm: LLMBackend,
+    summaries_collection: AsyncIOMotorCollection,
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    month: str,
+) -> Optional[str]:
+    weeks = _month_weeks(month)
+    # The weeks are independent, so the ones that changed are summarized at once
+    week_summaries = await asyncio.gather(
+        *(
+            week_summary(llm, summaries_collection, entries_collection, google_id, week)
+            for week in weeks
+        )
+    )
+    prompt = "<weeks>\n"
+    has_entries = False
+    for week, summary in zip(weeks, week_summaries):
+        if summary is None:
+            continue
+        has_entries = True
+        prompt += f"""
+    <week>
+        <key>{week}</key>
+        <summary>{summary}</summary>
+    </week>"""
+    prompt += "\n</weeks>"
+    if not has_entries:
+        return None
+    return f"""These are the summaries of each week of my diary in {month}. Tell me how my month went\n{prompt}"""
+
+
+async def _memoized(
+    summaries_collection: AsyncIOMotorCollection, google_id: str, key: str, source: str
+) -> Optional[str]:
+    # A summary stays valid for as long as the entries (or weeks) it was built from
+    memo = await summaries_collection.find_one(
+        {"_id": f"{google_id}:{key}", "source_hash": source}, {"summary": 1}
+    )
+    if memo:
+        stats["hits"] += 1
+        return memo["summary"]
+    stats["misses"] += 1
+    return None
+
+
+async def _store(
+    summaries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    period: str,
+    key: str,
+    source: str,
+    summary: str,
+) -> None:
+    await summaries_collection.replace_one(
+        {"_id": f"{google_id}:{key}"},
+        {
+            "google_id": google_id,
+            "period": period,
+            "key": key,
+            "source_hash": source,
+            "summary": summary,
+            "created_at": datetime.now(),
+        },
+        upsert=True,
+    )
+
+
+async def _join_in_flight(flight_key: str) -> Optional[str]:
+    """The summary another request is generating, None if there is none or it failed."""
+    flight = _in_flight.get(flight_key)
+    if flight is None:
+        return None
+    # Shielded, so a waiter going away does not cancel it for the request generating it
+    summary = await asyncio.shield(flight)
+    if summary is not None:
+        stats["shared"] += 1
+    return summary
+
+
+def _take_off(flight_key: str) -> asyncio.Future:
+    flight = asyncio.get_running_loop().create_future()
+    _in_flight[flight_key] = flight
+    return flight
+
+
+def _land(flight_key: str, flight: asyncio.Future, summary: Optional[str]) -> None:
+    # None tells the waiters to generate it themselves
+    if _in_flight.get(flight_key) is flight:
+        del _in_flight[flight_key]
+    flight.set_result(summary)
+
+
+async def _summary(
+    llm: LLMBackend,
+    summaries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    period: str,
+    key: str,
+    system_prompt: str,
+    message: Optional[str],
+) -> Optional[str]:
+    if message is None:
+        return None
+    source = _source_hash(system_prompt, message)
+    flight_key = f"{google_id}:{key}:{source}"
+    summary = await _memoized(summaries_collection, google_id, key, source)
+    if summary is None:
+        summary = await _join_in_flight(flight_key)
+    if summary is not None:
+        return summary
+    flight = _take_off(flight_key)
+    try:
+        summary = await llm_cache.chat(llm, MODEL, system_prompt, message)
+        await _store(summaries_collection, google_id, period, key, source, summary)
+        return summary
+    finally:
+        _land(flight_key, flight, summary)
+
+
+async def _summary_stream(
+    llm: LLMBackend,
+    summaries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    period: str,
+    key: str,
+    system_prompt: str,
+    message: Optional[str],
+) -> AsyncIterator[str]:
+    if message is None:
+        yield f"No entries yet for {key}."
+        return
+    source = _source_hash(system_prompt, message)
+    flight_key = f"{google_id}:{key}:{source}"
+    summary = await _memoized(summaries_collection, google_id, key, source)
+    if summary is None:
+        summary = await _join_in_flight(flight_key)
+    if summary is not None:
+        yield summary
+        return
+    flight = _take_off(flight_key)
+    try:
+        content: list[str] = []
+        async for delta in llm_cache.chat_stream(llm, MODEL, system_prompt, message):
+            content.append(delta)
+            yield delta
+        # Only stored when the stream was read to the end
+        summary = "".join(content)
+        await _store(summaries_collection, google_id, period, key, source, summary)
+    finally:
+        _land(flight_key, flight, summary)
+
+
+async def week_summary(
+    llm: LLMBackend,
+    summaries_collection: AsyncIOMotorCollection,
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    week: str,
+) -> Optional[str]:
+    """Summary of the ISO `week` ("YYYY-Www") from its entries' digests, None without entries.
+
+    Built once and reused until an entry of the week changes.
+    """
+    return await _summary(
+        llm,
+        summaries_collection,
+        google_id,
+        "week",
+        week,
+        diary_prompt.weekly_summary_system_prompt,
+        await _week_message(entries_collection, google_id, week),
+    )
+
+
+async def week_summary_stream(
+    llm: LLMBackend,
+    summaries_collection: AsyncIOMotorCollection,
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    week: str,
+) -> AsyncIterator[str]:
+    """`week_summary` as content deltas, the whole summary at once when it is memoized."""
+    message = await _week_message(entries_collection, google_id, week)
+    async for delta in _summary_stream(
+        llm,
+        summaries_collection,
+        google_id,
+        "week",
+        week,
+        diary_prompt.weekly_summary_system_prompt,
+        message,
+    ):
+        yield delta
+
+
+async def month_summary_stream(
+    llm: LLMBackend,
+    summaries_collection: AsyncIOMotorCollection,
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    month: str,
+) -> AsyncIterator[str]:
+    """Summary of `month` ("YYYY-MM") from the summaries of its weeks, as content deltas.
+
+    Only the weeks whose entries changed are summarized again, and the month itself only
+    when one of its weekly summaries changed.
+    """
+    message = await _month_message(
+        llm, summaries_collection, entries_collection, google_id, month
+    )
+    async for delta in _summary_stream(
+        llm,
+        summaries_collection,
+        google_id,
+        "month",
+        month,
+        diary_prompt.monthly_summary_system_prompt,
+        message,
+    ):
+        yield delta
+
+
+def get_stats() -> dict[str, float]:
+    lookups = stats["hits"] + stats["misses"]
+    return {**stats, "hit_rate": stats["hits"] / lookups if lookups else 0.0}
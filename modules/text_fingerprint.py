@@ -0,0 +1,40 @@
+import difflib
+import hashlib
+import os
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _common_prefix(a: str, b: str) -> int:
+    return len(os.path.commonprefix([a, b]))
+
+
+def changed_chars(previous: str, current: str) -> int:
+    """Approximate edit distance between two texts, ignoring whitespace changes.
+
+    Edits are usually in one place, so the common start and end are cut off first and
+    only the middle is diffed, by word so it stays fast on long entries. Junk detection
+    is off, it would treat frequent characters as unmatched on texts over 200 characters.
+    """
+    previous, current = " ".join(previous.split()), " ".join(current.split())
+    if previous == current:
+        return 0
+    start = _common_prefix(previous, current)
+    end = _common_prefix(previous[start:][::-1], current[start:][::-1])
+    previous = previous[start : len(previous) - end]
+    current = current[start : len(current) - end]
+    # Spaces are left out of the diff, as they match everywhere and slow it down, and
+    # counted back with the word they follow
+    previous_words, current_words = previous.split(), current.split()
+    matcher = difflib.SequenceMatcher(
+        None, previous_words, current_words, autojunk=False
+    )
+    matched = sum(
+        len(word) + 1
+        for block in matcher.get_matching_blocks()
+        for word in previous_words[block.a : block.a + block.size]
+    )
+    # The texts differ, so at least one character changed
+    return max(max(len(previous), len(current)) - matched, 1)
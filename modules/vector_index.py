@@ -0,0 +1,161 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+import modules.ann_index as ann_index
+import modules.embedding_codec as embedding_codec
+import modules.entries_repository as entries_repository
+
+PREVIEW_LENGTH = 100
+MAX_BYTES = int(os.getenv("VECTOR_INDEX_MAX_MB", "512")) * 1024 * 1024
+# Rebuilds from Mongo after this long, so writes made by other processes show up
+TTL_SECONDS = int(os.getenv("VECTOR_INDEX_TTL_SECONDS", "300"))
+
+
+class UserVectorIndex:
+    """Pre-normalized float32 embeddings of one user's entries, one row per date."""
+
+    def __init__(self, dates: list[str], previews: list[str], vectors: np.ndarray):
+        self.dates = dates
+        self.previews = previews
+        self.rows = {date: i for i, date in enumerate(dates)}
+        self.matrix = _normalize(vectors)
+        self.size = len(dates)
+        self.built_at = time.time()
+        self.lock = threading.Lock()
+        self.ann: Optional[ann_index.HnswIndex] = None
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+    def upsert(self, date: str, preview: str, vector: Optional[np.ndarray]) -> None:
+        with self.lock:
+            row = self.rows.get(date)
+            if row is None:
+                if vector is None:
+                    return
+                if self.size == len(self.matrix):
+                    # Grow geometrically so appends stay amortized O(d)
+                    grown = np.zeros(
+                        (max(2 * len(self.matrix), 8), len(vector)), dtype=np.float32
+                    )
+                    if self.size:
+                        grown[: self.size] = self.matrix[: self.size]
+                    self.matrix = grown
+                row = self.size
+                self.size += 1
+                self.rows[date] = row
+                self.dates.append(date)
+                self.previews.append(preview)
+            self.previews[row] = preview
+            if vector is not None:
+                self.matrix[row] = _normalize(np.asarray([vector]))[0]
+                if self.ann:
+                    self.ann.upsert(date, self.matrix[row])
+
+    def search(self, query_vector: list[float], k: int) -> list[tuple[str, str]]:
+        """Top `k` entries by cosine similarity, most similar first.
+
+        Returns:
+            list[tuple[str, str]]: (date, text preview) of each match
+        """
+        query = _normalize(np.asarray([query_vector]))[0]
+        if self.ann:
+            return [
+                (date, self.previews[self.rows[date]])
+                for date in self.ann.search(query, k)
+                if date in self.rows
+            ]
+        with self.lock:
+            if self.size == 0:
+                return []
+            similarities = self.matrix[: self.size] @ query
+            k = min(k, self.size)
+            top = np.argpartition(-similarities, k - 1)[:k]
+            top = top[np.argsort(-similarities[top])]
+            return [(self.dates[i], self.previews[i]) for i in top]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if vectors.size == 0:
+        return vectors
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+_indexes: OrderedDict[str, UserVectorIndex] = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+async def _build(
+    entries_collection: AsyncIOMotorCollection, google_id: str
+) -> UserVectorIndex:
+    # Only the vectors and the first characters of each text leave the database
+    entries = await entries_repository.search_vectors(
+        entries_collection, google_id, PREVIEW_LENGTH
+    )
+    index = UserVectorIndex(
+        [entry["date"] for entry in entries],
+        [entry["preview"] for entry in entries],
+        np.array(
+            [embedding_codec.decode(entry) for entry in entries], dtype=np.float32
+        ),
+    )
+    # Loading or catching up the HNSW graph is disk and CPU bound, keep it off the event loop
+    index.ann = await asyncio.to_thread(
+        ann_index.load, google_id, index.dates, index.matrix[: index.size]
+    )
+    return index
+
+
+async def get_index(
+    entries_collection: AsyncIOMotorCollection, google_id: str
+) -> UserVectorIndex:
+    """Returns the user's index, building it on first use or once it is older than the TTL."""
+    with _indexes_lock:
+        index = _indexes.get(google_id)
+        if index and time.time() - index.built_at < TTL_SECONDS:
+            _indexes.move_to_end(google_id)
+            return index
+
+    index = await _build(entries_collection, google_id)
+    with _indexes_lock:
+        _indexes[google_id] = index
+        _indexes.move_to_end(google_id)
+        total = sum(cached.nbytes for cached in _indexes.values())
+        while total > MAX_BYTES and len(_indexes) > 1:
+            _, evicted = _indexes.popitem(last=False)
+            total -= evicted.nbytes
+    return index
+
+
+def upsert(google_id: str, date: str, text: str, vector: Optional[np.ndarray]) -> None:
+    """Applies a written entry to the user's index if it is loaded, otherwise it is built lazily."""
+    with _indexes_lock:
+        index = _indexes.get(google_id)
+    if index:
+        index.upsert(date, text[:PREVIEW_LENGTH], vector)
+
+
+def invalidate(google_id: str) -> None:
+    with _indexes_lock:
+        _indexes.pop(google_id, None)
+
+
+async def search(
+    entries_collection: AsyncIOMotorCollection,
+    google_id: str,
+    query_vector: list[float],
+    k: int,
+) -> list[tuple[str, str]]:
+    index = await get_index(entries_collection, google_id)
+    return index.search(query_vector, k)
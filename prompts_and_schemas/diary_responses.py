@@ -141,3 +141,37 @@ class HealthScore(BaseModel):
     improvement_suggestions: Optional[list[str]] = Field(
         description="Give a few brief suggestions on how this person could have increased their fulfillment score. Give no more that 5 suggestions.",
     )
+
+
+combined_system_prompt = f"""
+<overview>
+    You are a team of four specialists reviewing the same entry from my diary. Each specialist reads it carefully and scores their own category independently of the others, following only their own instructions below.
+</overview>
+<socialization-specialist>
+{socialization_system_prompt}
+</socialization-specialist>
+<productivity-specialist>
+{productivity_system_prompt}
+</productivity-specialist>
+<fulfillment-specialist>
+{fulfillment_system_prompt}
+</fulfillment-specialist>
+<health-specialist>
+{health_system_prompt}
+</health-specialist>
+"""
+
+
+class DiaryAnalysis(BaseModel):
+    socialization: SocializationScore = Field(
+        description="The socialization specialist's score, reason and suggestions.",
+    )
+    productivity: ProductivityScore = Field(
+        description="The productivity specialist's score, reason and suggestions.",
+    )
+    fulfillment: FulfillmentScore = Field(
+        description="The fulfillment specialist's score, reason and suggestions.",
+    )
+    health: HealthScore = Field(
+        description="The health specialist's score, reason and suggestions.",
+    )
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Lets the tests import `modules` when pytest is run from anywhere in the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
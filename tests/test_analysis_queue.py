@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+import modules.analysis_queue as analysis_queue
+
+
+class _Jobs:
+    """Just enough of a jobs collection for `_finish`, holding one job."""
+
+    def __init__(self, lease: str):
+        self.lease = lease
+        self.updates: list[dict] = []
+
+    def update_one(self, filter: dict, update: dict):
+        matched = filter["lease"] == self.lease
+        if matched:
+            self.updates.append(update)
+        return SimpleNamespace(matched_count=int(matched))
+
+
+def _job(attempts: int) -> dict:
+    return {
+        "_id": "job",
+        "google_id": "g1",
+        "date": "2025-01-01",
+        "text": "Went hiking",
+        "lease": "lease",
+        "attempts": attempts,
+    }
+
+
+def test_last_failed_attempt_reports_the_job():
+    jobs = _Jobs("lease")
+    failed = []
+    analysis_queue._finish(
+        jobs, _job(analysis_queue.MAX_ATTEMPTS), RuntimeError(), failed.append
+    )
+    assert [job["text"] for job in failed] == ["Went hiking"]
+    assert jobs.updates[0]["$set"]["status"] == "failed"
+    assert {"text", "previous"} <= set(jobs.updates[0]["$unset"])
+
+
+def test_retried_job_keeps_its_text():
+    jobs = _Jobs("lease")
+    failed = []
+    analysis_queue._finish(jobs, _job(1), RuntimeError(), failed.append)
+    assert failed == []
+    assert jobs.updates[0]["$set"]["status"] == "pending"
+    assert "text" not in jobs.updates[0]["$unset"]
+
+
+def test_reclaimed_job_is_not_reported():
+    jobs = _Jobs("other lease")
+    failed = []
+    analysis_queue._finish(
+        jobs, _job(analysis_queue.MAX_ATTEMPTS), RuntimeError(), failed.append
+    )
+    assert failed == []
+    assert jobs.updates == []
@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime
+
+import fasthtml.common as fh
+
+import modules.dashboard as dashboard
+import modules.entry_cache as entry_cache
+
+
+def _request(headers: dict[str, str]) -> fh.Request:
+    return fh.Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/dashboard/plot_data",
+            "headers": [
+                (name.lower().encode(), value.encode())
+                for name, value in headers.items()
+            ],
+        }
+    )
+
+
+def _plot_data(monkeypatch, user_id: str, headers: dict[str, str]) -> fh.Response:
+    async def get_version(google_id):
+        # Both users have written as many times, so only the user tells them apart
+        return 3, datetime(2025, 1, 1, 12)
+
+    async def get_rollup(google_id, entries_collection, rollups_collection):
+        return {"days": {}, "weeks": {}}
+
+    monkeypatch.setattr(entry_cache, "get_version", get_version)
+    monkeypatch.setattr(dashboard, "_get_rollup", get_rollup)
+    return asyncio.run(
+        dashboard.plot_data(
+            _request(headers),
+            "days",
+            500,
+            {"user_info": {"id": user_id}},
+            None,
+            None,
+        )
+    )
+
+
+def test_plot_data_is_not_modified_for_the_same_user(monkeypatch):
+    first = _plot_data(monkeypatch, "user-a", {})
+    assert first.status_code == 200
+    assert first.headers["vary"] == "Cookie"
+
+    again = _plot_data(monkeypatch, "user-a", {"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304
+
+
+def test_plot_data_etag_does_not_match_another_user(monkeypatch):
+    etag = _plot_data(monkeypatch, "user-a", {}).headers["etag"]
+
+    response = _plot_data(monkeypatch, "user-b", {"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
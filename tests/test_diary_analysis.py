@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+import modules.diary_analysis as diary_analysis
+import prompts_and_schemas.diary_responses as diary_responses
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _fingerprint(monkeypatch, mode: str, combined_prompt: str) -> str:
+    monkeypatch.setattr(diary_analysis, "ANALYSIS_MODE", mode)
+    monkeypatch.setattr(diary_responses, "combined_system_prompt", combined_prompt)
+    diary_analysis._category_signature.cache_clear()
+    return diary_analysis._category_fingerprint("health", "Went for a run")
+
+
+def test_combined_prompt_change_invalidates_combined_results(monkeypatch):
+    try:
+        assert _fingerprint(monkeypatch, "combined", "v1") != _fingerprint(
+            monkeypatch, "combined", "v2"
+        )
+        # Fan-out results do not depend on the combined prompt
+        assert _fingerprint(monkeypatch, "fanout", "v1") == _fingerprint(
+            monkeypatch, "fanout", "v2"
+        )
+    finally:
+        diary_analysis._category_signature.cache_clear()
+
+
+def test_unknown_analysis_mode_fails_at_import():
+    result = subprocess.run(
+        [sys.executable, "-c", "import modules.diary_analysis"],
+        cwd=REPO_ROOT,
+        env={**os.environ, "ANALYSIS_MODE": "fan-out"},
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode != 0
+    assert "ANALYSIS_MODE" in result.stderr
@@ -0,0 +1,56 @@
+import asyncio
+
+import modules.prompt_drafts as prompt_drafts
+
+
+class _Drafts:
+    """Just enough of a drafts collection for `call_while_latest`."""
+
+    def __init__(self, draft_id: str):
+        self.draft_id = draft_id
+
+    async def find_one(self, filter: dict, projection: dict):
+        if filter["draft_id"]["$ne"] != self.draft_id:
+            return {"_id": filter["_id"]}
+        return None
+
+
+def test_replaced_draft_cancels_call(monkeypatch):
+    monkeypatch.setattr(prompt_drafts, "CHECK_SECONDS", 0.01)
+    drafts = _Drafts("first")
+    cancelled = asyncio.Event()
+
+    async def completion():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def run():
+        call = asyncio.create_task(
+            prompt_drafts.call_while_latest(drafts, "session", "first", completion())
+        )
+        await asyncio.sleep(0.05)
+        drafts.draft_id = "second"
+        result = await asyncio.wait_for(call, 1)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) is None
+    assert cancelled.is_set()
+
+
+def test_latest_draft_returns_result(monkeypatch):
+    monkeypatch.setattr(prompt_drafts, "CHECK_SECONDS", 0.01)
+
+    async def completion():
+        await asyncio.sleep(0.03)
+        return "Write about your walk"
+
+    result = asyncio.run(
+        prompt_drafts.call_while_latest(
+            _Drafts("first"), "session", "first", completion()
+        )
+    )
+    assert result == "Write about your walk"
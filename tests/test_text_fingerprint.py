@@ -0,0 +1,38 @@
+import random
+
+from modules.text_fingerprint import changed_chars
+
+# Long enough that difflib's junk heuristic would treat its common characters as junk
+LONG_TEXT = " ".join(
+    [
+        "Today I woke up early and went for a long walk around the lake.",
+        "The weather was cold but the sun came out in the afternoon, so I sat on a",
+        "bench and read for an hour. Later I met a friend for coffee and we talked",
+        "about work, our families and the trip we are planning for the summer.",
+        "In the evening I cooked dinner, cleaned the kitchen and went to bed early",
+        "because I have a busy day tomorrow with meetings from nine until five.",
+    ]
+    * 3
+)
+
+
+def test_one_character_edit_in_a_long_text():
+    assert len(LONG_TEXT) > 1000
+    edited = LONG_TEXT.replace("lake.", "lake!", 1)
+    assert changed_chars(LONG_TEXT, edited) == 1
+
+
+def test_appended_sentence_counts_its_length():
+    assert changed_chars(LONG_TEXT, LONG_TEXT + " Good day.") == len(" Good day.")
+
+
+def test_single_typos_anywhere_count_as_one_character():
+    rng = random.Random(0)
+    for _ in range(200):
+        i = rng.randrange(len(LONG_TEXT))
+        edited = LONG_TEXT[:i] + rng.choice("xyzq") + LONG_TEXT[i + 1 :]
+        assert changed_chars(LONG_TEXT, edited) <= 1
+
+
+def test_whitespace_changes_are_ignored():
+    assert changed_chars("one  two\nthree", "one two three") == 0